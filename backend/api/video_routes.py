@@ -1,25 +1,36 @@
 import os
-import time
 import json
-import glob
+import math
 import shutil
-import whisper
-import pandas as pd
-from threading import Thread, Lock
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pytubefix import YouTube
-from moviepy import VideoFileClip
-from flask import Blueprint, request, jsonify, url_for, current_app, send_from_directory
-from init import overview_chain, search_content_chain, search_youtube
-from pydub import AudioSegment
-from pydub.utils import make_chunks
-from collections import defaultdict
+from flask import Blueprint, Response, request, jsonify, url_for, current_app, send_from_directory, stream_with_context
+from init import artifact_store, asr_model, asr_vad, asr_vad_min_speech, asr_chunk_seconds, asr_batch_size, job_manager, llm_cache, clip_renderer, video_metadata, acquisition_mode, overview_chain, search_content_chain, search_youtube, search_concurrency, prefilter_top_k, window_token_budget, video_concurrency, resource_pools, streaming_search, search_stop, library_index
+from libs.audio_pipeline import SAMPLE_RATE, Spool, batches, decode_audio_chunks, prefetch, probe_duration
+from libs.transcript_store import TranscriptStore, TRANSCRIPT_FILENAME
+from libs.artifact_store import temp_path
+from libs.single_flight import SingleFlight
+from libs.jobs import QueueFullError
+from libs.prefilter import select_windows
+from libs.incremental_search import IncrementalSearch
+from libs.search_content import ScanBudget, scan_coverage
+from libs.transcript_format import pack_windows
+from libs.metrics import metrics
+from libs.vad import make_detector, offset_chunks, speech_chunks
 
 video_bp = Blueprint('video_routes', __name__, url_prefix='/api/videos')
-download_dir = './downloads'
-asr_model = whisper.load_model("turbo")
+VAD_BLOCK_SECONDS = 30  # audio decoded per read when chunks are cut by the VAD
+ANALYSIS_LENGTH = 120  # longest transcript window screened by one LLM call, in seconds
+download_dir = artifact_store.root
+asr_flights = SingleFlight('asr')
 
-tasks = {}
-tasks_lock = Lock()  # Lock to manage access to tasks dictionary
+tasks = job_manager.tasks
+tasks_lock = job_manager.lock  # Lock to manage access to tasks dictionary
+
+def busy_response(e):
+    return jsonify({"status": "error", "message": f"Server is busy, please retry later: {str(e)}"}), 429
 
 # Helper Functions for Thread-Safe Task Updates
 def update_task(task_id, updates):
@@ -27,40 +38,114 @@ def update_task(task_id, updates):
     with tasks_lock:
         if task_id in tasks:
             tasks[task_id].update(updates)
+            job_manager.touch(task_id)
+            parent_id = tasks[task_id].get('parent')
+            if parent_id in tasks:
+                _sync_parent_task(parent_id)
+                job_manager.touch(parent_id)
+
+def _sync_parent_task(task_id):
+    """Summarize the per-video subtasks of an analyze task into its record, caller holds tasks_lock"""
+    task = tasks[task_id]
+    children = [tasks.get(child_id, {}) for child_id in task.get('children', [])]
+    task['videos'] = [{
+        "status": child.get("status", "completed"),
+        "subtask_type": child.get("subtask_type", ""),
+        "progress": child.get("progress", 100),
+        "message": child.get("message", ""),
+        **({"coverage": child["coverage"]} if "coverage" in child else {}),
+    } for child in children]
+    active = [i for i, video in enumerate(task['videos']) if video['status'] == 'processing' and video['progress'] < 100]
+    if active:
+        task['current_video'] = active[0]
+        task['progress'] = min(task['videos'][active[0]]['progress'], 99)
+        task['subtask_type'] = task['videos'][active[0]]['subtask_type']
+    # Matches found so far in any video, while the search is still running
+    partial = [dict(match, video=i) for i, child in enumerate(children) for match in child.get('partial_data', [])]
+    if partial:
+        task['partial_data'] = partial
 
 def get_task(task_id):
     """Thread-safe method to get task data"""
     with tasks_lock:
         return tasks.get(task_id)
 
-@video_bp.route('/progress/<task_id>', methods=['GET'])
-def progress(task_id):
-    task = get_task(task_id)
-    if not task:
-        return jsonify({"status": "error", "message": "Task not found"}), 404
-
+def _progress_response(task_id, task):
+    """Client-facing progress of a task, with its (partial) results once available"""
     response = {
         "task_type": task["task_type"],
         "subtask_type": task.get("subtask_type", ""),
         "current_video": task.get("current_video", 0),
         "progress": task["progress"],
         "message": task["message"],
+        "version": task.get("version", 0),
     }
+    if "videos" in task:
+        response["videos"] = task["videos"]
     response["status"] = "completed" if task["progress"] >= 100 and response["subtask_type"] == "" else "processing"
+    if task["status"] == "queued":
+        response["status"] = "queued"
+        response["queue_position"] = job_manager.queue_position(task_id)
+    elif task["status"] == "error":
+        response["status"] = "error"
+
+    if "metrics" in task:
+        # Stage timings and LLM usage, set once the job has finished
+        response["metrics"] = task["metrics"]
+    if "coverage" in task:
+        # Which parts of the video the LLM screened, and why it stopped early if it did
+        response["coverage"] = task["coverage"]
 
     if response["status"] == "completed":
         response["data"] = task.get("data", {})
-        # print(response["data"])
-        with tasks_lock:
-            tasks.pop(task_id, None)
+    elif "partial_data" in task:
+        response["partial_data"] = task["partial_data"]
+    return response
 
-    elif task["status"] == "error":
-        with tasks_lock:
-            tasks.pop(task_id, None)
+@video_bp.route('/progress/<task_id>', methods=['GET'])
+def progress(task_id):
+    # Long-poll: with ?since=<version>, wait up to ?wait= seconds for the task to change
+    since = request.args.get('since', type=int)
+    if since is not None:
+        task = job_manager.wait_for_change(task_id, since, timeout=min(request.args.get('wait', 30, type=float), 60))
+    else:
+        task = get_task(task_id)
+    if not task:
+        return jsonify({"status": "error", "message": "Task not found"}), 404
+
+    response = _progress_response(task_id, task)
+    # Finished tasks stay retrievable until the job manager evicts them after TASK_TTL
+    if response["status"] == "error":
         return jsonify({"status": "error", "message": task["message"]}), 500
 
     return jsonify(response), 200
 
+@video_bp.route('/progress/<task_id>/stream', methods=['GET'])
+def progress_stream(task_id):
+    """Server-sent events carrying the task's progress every time it changes"""
+    def events():
+        version = None
+        while True:
+            task = job_manager.wait_for_change(task_id, version, timeout=15)
+            if task is None:
+                yield f"event: error\ndata: {json.dumps({'status': 'error', 'message': 'Task not found'})}\n\n"
+                return
+            if task.get("version") == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = task.get("version")
+            response = _progress_response(task_id, task)
+            if response["status"] == "error":
+                response["message"] = task["message"]
+            yield f"id: {version}\ndata: {json.dumps(response)}\n\n"
+            if response["status"] in ("completed", "error"):
+                return
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @video_bp.route('/advanced_search', methods=['POST'])
 def advanced_search():
     data = request.get_json()
@@ -68,58 +153,87 @@ def advanced_search():
     if not query:
         return jsonify({"status": "error", "message": "Query is required"}), 400
 
-    task_id = str(int(time.time()))
-
-    with tasks_lock:
-        tasks[task_id] = {
-            "task_type": "advanced_search",
-            "status": "processing",
-            "progress": 0,
-            "message": "Processing the query",
-            "data": []
-        }
-
-    thread = Thread(target=_advanced_search, args=(task_id, query), daemon=True)
-    thread.start()
+    record = {
+        "task_type": "advanced_search",
+        "progress": 0,
+        "message": "Processing the query",
+        "data": []
+    }
+    try:
+        if job_manager.loop is not None:
+            task_id = job_manager.submit_async(lambda task_id: _advanced_search_async(task_id, query), record)
+        else:
+            task_id = job_manager.submit(lambda task_id: _advanced_search(task_id, query), record, priority=0)
+    except QueueFullError as e:
+        return busy_response(e)
 
     return jsonify({"status": "success", "task_id": task_id})
 
 def _advanced_search(task_id, query):
     try:
-        result = overview_chain.process(query)
-        if result['success']:
-            search_query = overview_chain.generate_search_query(result['data'])
-            print("Search Query: {} | Original Query: {}".format(search_query, query))
-            preliminary_result = search_youtube.search(search_query)
-            if len(preliminary_result['data']) == 0:
-                raise Exception("No videos found for the query")
-            postprocessed_result = search_youtube.postprocess(preliminary_result, search_query)
-            if postprocessed_result['success']:
-                videos = postprocessed_result['data']
-                update_task(task_id, {
-                    "status": "completed",
-                    "progress": 100,
-                    "message": "Successfully processed the query",
-                    "data": {
-                        "videos": videos,
-                        "query": {
-                            'query': query,
-                            '4w1h': result['data']
-                        }
-                    }
-                })
-            else:
-                raise Exception("Failed to search for videos")
-        else:
-            raise Exception("Failed to process the query")
+        # Moments from videos processed before are found locally, ahead of the YouTube search
+        library_moments = _library_moments(task_id, library_index.search(query))
+        overview = _succeeded(overview_chain.process(query), "Failed to process the query")
+        search_query = overview_chain.generate_search_query(overview)
+        print("Search Query: {} | Original Query: {}".format(search_query, query))
+        preliminary_result = _found_videos(search_youtube.search(search_query))
+        videos = _succeeded(search_youtube.postprocess(preliminary_result, search_query), "Failed to search for videos")
+        _complete_advanced_search(task_id, query, overview, videos, library_moments)
     except Exception as e:
-        print("Error in advanced_search: ", e)
-        update_task(task_id, {
-            "status": "error",
-            "progress": 100,
-            "message": f"Error in advanced_search: {str(e)}",
-            "data": []
-        })
+        _fail_advanced_search(task_id, e)
+
+async def _advanced_search_async(task_id, query):
+    """`_advanced_search` on the event loop: LLM calls and the YouTube search are awaited, not run in a thread"""
+    try:
+        library_moments = _library_moments(task_id, await asyncio.to_thread(library_index.search, query))
+        overview = _succeeded(await overview_chain.aprocess(query), "Failed to process the query")
+        search_query = await overview_chain.agenerate_search_query(overview)
+        print("Search Query: {} | Original Query: {}".format(search_query, query))
+        preliminary_result = _found_videos(await search_youtube.asearch(search_query))
+        videos = _succeeded(await search_youtube.apostprocess(preliminary_result, search_query), "Failed to search for videos")
+        _complete_advanced_search(task_id, query, overview, videos, library_moments)
+    except Exception as e:
+        _fail_advanced_search(task_id, e)
+
+def _library_moments(task_id, library_moments):
+    if library_moments:
+        update_task(task_id, {"partial_data": library_moments})
+    return library_moments
+
+def _succeeded(result, message):
+    """The data of a task result, raising `message` when the task failed"""
+    if not result['success']:
+        raise Exception(message)
+    return result['data']
+
+def _found_videos(preliminary_result):
+    if len(preliminary_result['data']) == 0:
+        raise Exception("No videos found for the query")
+    return preliminary_result
+
+def _complete_advanced_search(task_id, query, overview, videos, library_moments):
+    update_task(task_id, {
+        "status": "completed",
+        "progress": 100,
+        "message": "Successfully processed the query",
+        "data": {
+            "videos": videos,
+            "library": library_moments,
+            "query": {
+                'query': query,
+                '4w1h': overview
+            }
+        }
+    })
+
+def _fail_advanced_search(task_id, e):
+    print("Error in advanced_search: ", e)
+    update_task(task_id, {
+        "status": "error",
+        "progress": 100,
+        "message": f"Error in advanced_search: {str(e)}",
+        "data": []
+    })
 
 @video_bp.route('/analyze', methods=['POST'])
 def analyze():
@@ -130,41 +244,56 @@ def analyze():
 
     if not videos:
         return jsonify({"status": "error", "message": "Videos are required"}), 400
+    try:
+        stop = _parse_stop(data.get('stop'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     
-    task_id = str(int(time.time()))
-    with tasks_lock:
-        tasks[task_id] = {
+    app = current_app._get_current_object()
+    try:
+        task_id = job_manager.submit(lambda task_id: _analyze(app, videos, task_id, query, stop), {
             "task_type": "analyze",
-            "status": "processing",
             "progress": 0,
             "message": "Processing the videos",
             "data": []
-        }
-
-    thread = Thread(target=_analyze, args=(current_app._get_current_object(), videos, task_id, query), daemon=True)
-    thread.start()
+        }, priority=10)
+    except QueueFullError as e:
+        return busy_response(e)
 
-    return jsonify({"status": "success", "message": "Successfully processed the videos sequentially", "task_id": task_id})
+    return jsonify({"status": "success", "message": "Successfully started processing the videos", "task_id": task_id})
 
-def _analyze(app, videos, task_id, query):
+def _analyze(app, videos, task_id, query, stop=None):
     try:
-        datas = []
-        for i, video in enumerate(videos):
-            update_task(task_id, {
-                "progress": 1,
-                "subtask_type": "analyze_asr",
-                "current_video": i,
-                "message": "Transcribing the audio",
-            })
-            _analyze_asr(video, task_id)
-            update_task(task_id, {
-                "subtask_type": "search_content",
-                "message": "Searching for content",
-            })
-            metadata = get_task(task_id)['data']
-            _search_content(app, task_id, query, metadata)
-            datas.extend(get_task(task_id)['data'])
+        # Each video runs as a subtask; the resource pools keep one video's
+        # download overlapping another's transcription or LLM screening
+        child_ids = [f"{task_id}:{i}" for i in range(len(videos))]
+        with tasks_lock:
+            for child_id in child_ids:
+                tasks[child_id] = {
+                    "task_type": "analyze_video",
+                    "parent": task_id,
+                    "status": "processing",
+                    "subtask_type": "analyze_asr",
+                    "progress": 0,
+                    "message": "Waiting to be processed",
+                    "data": [],
+                }
+            tasks[task_id].update({"children": child_ids, "subtask_type": "analyze_asr", "current_video": 0})
+            _sync_parent_task(task_id)
+            job_manager.touch(task_id)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(video_concurrency, len(videos)))) as executor:
+            futures = [
+                executor.submit(metrics.in_context(_analyze_video), app, video, child_id, query, stop)
+                for video, child_id in zip(videos, child_ids)
+            ]
+            datas = []
+            for future in futures:
+                datas.extend(future.result())
 
+        with tasks_lock:
+            for child_id in child_ids:
+                tasks.pop(child_id, None)
         update_task(task_id, {
             "subtask_type": "",
             "progress": 100,
@@ -182,6 +311,48 @@ def _analyze(app, videos, task_id, query):
             "data": []
         })
 
+def _analyze_video(app, video, task_id, query, stop=None):
+    update_task(task_id, {
+        "progress": 1,
+        "subtask_type": "analyze_asr",
+        "message": "Transcribing the audio",
+    })
+    search = None
+    if streaming_search:
+        # Windows are screened as soon as the chunks covering them are transcribed
+        partial_data = []
+        def on_match(match):
+            partial_data.append(match)
+            update_task(task_id, {"partial_data": sorted(partial_data, key=lambda match: match['start_time'])})
+
+        search = IncrementalSearch(
+            search_content_chain, query, token_budget=window_token_budget, max_length=ANALYSIS_LENGTH,
+            prefilter={'top_k': prefilter_top_k}, max_concurrency=search_concurrency,
+            slot=lambda: resource_pools.slot('llm'), on_match=on_match, budget=_scan_budget(stop),
+        )
+    _analyze_asr(video, task_id, on_words=search.add if search is not None else None)
+    if get_task(task_id)['status'] == 'error':
+        if search is not None:
+            search.cancel()
+        return []
+    update_task(task_id, {
+        "subtask_type": "search_content",
+        "message": "Searching for content",
+    })
+    metadata = dict(get_task(task_id)['data'], stop=stop)
+    search_results = None
+    if search is not None:
+        if not search.streamed:
+            # The transcript was already on disk, nothing was streamed
+            transcript = TranscriptStore.load(metadata)
+            search.add(transcript.words(), transcript.starts, transcript.ends, transcript.segments)
+        search_results = search.finish()
+        update_task(task_id, {"coverage": search.coverage()})
+    _search_content(app, task_id, query, metadata, search_results=search_results)
+    task = get_task(task_id)
+    update_task(task_id, {"subtask_type": "", "status": "completed" if task['status'] != 'error' else 'error'})
+    return task['data'] if task['status'] != 'error' else []
+
 @video_bp.route('/analyze_asr', methods=['POST'])
 def analyze_asr():
     data = request.get_json()
@@ -190,76 +361,146 @@ def analyze_asr():
     if not video:
         return jsonify({"status": "error", "message": "Video data is required"}), 400
 
-    task_id = str(int(time.time()))
-    with tasks_lock:
-        tasks[task_id] = {
+    try:
+        task_id = job_manager.submit(lambda task_id: _analyze_asr(video, task_id), {
             "task_type": "analyze_asr",
-            "status": "processing",
             "progress": 0,
             "message": "Processing the audio",
             "data": {}
-        }
-    
-    thread = Thread(target=_analyze_asr, args=(video, task_id), daemon=True)
-    thread.start()
+        }, priority=10)
+    except QueueFullError as e:
+        return busy_response(e)
 
     return jsonify({"status": "success", "task_id": task_id})
 
-def _analyze_asr(video, task_id, chunk_length_ms=120 * 1000):
+def _transcribe_video(video, video_out_dir, chunk_length, flight, on_words=None):
+    """Transcribe a video into its transcript store unless that was done already, reporting progress to every task in `flight`"""
+    video_out_path = os.path.join(video_out_dir, 'raw_video.mp4')
+    transcript_path = os.path.join(video_out_dir, TRANSCRIPT_FILENAME)
+
+    def report(updates):
+        for member in flight.members():
+            update_task(member, updates)
+
+    legacy_transcription_dir = os.path.join(video_out_dir, 'transcriptions')
+    if not os.path.exists(transcript_path) and os.path.isdir(legacy_transcription_dir):
+        TranscriptStore.from_csv_dir(legacy_transcription_dir, transcript_path, chunk_length=chunk_length)
+
+    if not os.path.exists(transcript_path):
+        # Download, audio decoding and ASR run as a pipeline: the stream is spooled to disk at network
+        # speed (holding a download slot only that long) and decoded as it grows, while Whisper
+        # transcribes the chunks decoded so far
+        spool, spool_path, partial_video_path = None, None, None
+        with metrics.span('resolve_source'):
+            if os.path.exists(video_out_path):
+                source = video_out_path
+                duration = probe_duration(video_out_path)
+            elif acquisition_mode == 'audio_only':
+                # Only the smallest audio stream is needed for ASR, the video is
+                # fetched later and only for the spans of the ranked clips
+                yt = YouTube(video['url'])
+                source = yt.streams.filter(only_audio=True).order_by('abr').first().url
+                spool_path = temp_path(os.path.join(video_out_dir, 'audio'), '.part')
+                duration = video_metadata.resolve(video['url'])['length']
+            else:
+                yt = YouTube(video['url'])
+                source = yt.streams.first().url
+                # The spooled progressive stream is the video file itself
+                spool_path = partial_video_path = temp_path(video_out_path, '.part')
+                duration = video_metadata.resolve(video['url'])['length']
+        if spool_path is not None:
+            spool = source = Spool(source, spool_path, slot=lambda: resource_pools.slot('download')).start()
+        report({'progress': 10})
+
+        # The detector adapts to the recording, so every video gets its own
+        speech_detector = make_detector(asr_vad, asr_vad_min_speech)
+        if speech_detector is None:
+            chunks = offset_chunks(decode_audio_chunks(source, asr_chunk_seconds))
+        else:
+            # Only speech is transcribed, in chunks that end in pauses rather than mid-word
+            blocks = decode_audio_chunks(source, VAD_BLOCK_SECONDS)
+            chunks = speech_chunks(blocks, speech_detector, max_length_s=asr_chunk_seconds)
+        # Waiting for the next batch is time spent downloading and decoding audio
+        # When words are streamed to a search, batches start at one chunk so the first windows come early
+        chunk_batches = metrics.iterate('download_audio', batches(
+            prefetch(chunks, depth=asr_batch_size), asr_batch_size,
+            first=1 if on_words is not None else None))
+        try:
+            words, starts, ends, segments = [], [], [], []
+            num_segments = 0
+            speech_seconds = 0.0
+            for batch in chunk_batches:
+                num_words = len(words)
+                # Chunks of up to 30s are encoded and decoded by Whisper together
+                with resource_pools.slot('asr'), metrics.span('asr'):
+                    results = asr_model.transcribe_batch([chunk for _, chunk in batch], word_timestamps=True)
+                for (offset, chunk), result in zip(batch, results):
+                    for segment in result["segments"]:
+                        for word in segment["words"]:
+                            words.append(word['word'])
+                            starts.append(round(word['start'] + offset, 2))
+                            ends.append(round(word['end'] + offset, 2))
+                            segments.append(num_segments)
+                        num_segments += 1
+                    speech_seconds += len(chunk) / SAMPLE_RATE
+                if on_words is not None:
+                    on_words(words[num_words:], starts[num_words:], ends[num_words:], segments[num_words:])
+
+                chunk_end = batch[-1][0] + len(batch[-1][1]) / SAMPLE_RATE
+                report({'progress': min(10 + int(chunk_end / max(duration, 1) * 90), 99)})
+
+            if partial_video_path is not None:
+                os.replace(partial_video_path, video_out_path)
+        finally:
+            if spool is not None:
+                spool.cancel()
+            # The spooled audio, or a video whose transcription failed
+            if spool_path is not None and os.path.exists(spool_path):
+                os.remove(spool_path)
+        # Written last and renamed into place, the transcript marks the whole job as complete
+        with metrics.span('transcript_write'):
+            TranscriptStore.write(transcript_path, words, starts, ends, meta={
+                'duration': duration,
+                'chunk_length': chunk_length,
+                'speech_seconds': round(speech_seconds, 2),
+            }, extra_arrays={'segment': np.asarray(segments, dtype='<i4')})
+
+    if not library_index.has(video['id']):
+        # New transcripts become searchable across the library right away
+        with metrics.span('library_index'):
+            try:
+                library_index.add(video['id'], TranscriptStore(transcript_path), url=video['url'], title=video.get('title'))
+            except Exception as e:
+                print("Error indexing transcript: ", e)
+    return transcript_path
+
+def _analyze_asr(video, task_id, chunk_length_ms=ANALYSIS_LENGTH * 1000, on_words=None):
+    # on_words(words, starts, ends, segments) receives the words of every transcribed batch as they come
     try:
         print(video)
         update_task(task_id, {'progress': 5})
-        video_out_dir = os.path.join(download_dir, video['id'])
-        if not os.path.exists(video_out_dir):
-            os.makedirs(video_out_dir, exist_ok=True)
-
-            yt = YouTube(video['url'])
-            stream = yt.streams.first()
-            video_out_path = stream.download(video_out_dir, filename='raw_video.mp4')
-            audio_out_path = os.path.join(video_out_dir, 'raw_audio.wav')
-            video_clip = VideoFileClip(video_out_path)
-            audio = video_clip.audio
-            audio.write_audiofile(audio_out_path)
-            video_clip.close()
-            audio.close()
-
-        update_task(task_id, {'progress': 10})
-
-        audio_out_path = os.path.join(video_out_dir, 'raw_audio.wav')
-        audio_out_chunk_dir = os.path.join(video_out_dir, 'chunks')
-        transcription_out_dir = os.path.join(video_out_dir, 'transcriptions')
-        os.makedirs(audio_out_chunk_dir, exist_ok=True)
-        os.makedirs(transcription_out_dir, exist_ok=True)
-
-        audio = AudioSegment.from_file(audio_out_path)
-        chunks = make_chunks(audio, chunk_length_ms)
-
-        progress_step = int(90 / len(chunks))
-        for i, chunk in enumerate(chunks):
-            audio_chunk_path = os.path.join(audio_out_chunk_dir, f"{i:04d}.wav")
-            if not os.path.exists(audio_chunk_path):
-                chunk.export(audio_chunk_path, format="wav")
-
-            transcription_out_path = os.path.join(transcription_out_dir, f"{i:04d}.csv")
-            if not os.path.exists(transcription_out_path):
-                result = asr_model.transcribe(audio_chunk_path, word_timestamps=True)
-                df = defaultdict(list)
-                for segment in result["segments"]:
-                    for word in segment["words"]:
-                        df['word'].append(word['word'])
-                        df['start'].append(round(word['start'] + i * chunk_length_ms / 1000, 2))
-                        df['end'].append(round(word['end'] + i * chunk_length_ms / 1000, 2))
-                pd.DataFrame(df).to_csv(transcription_out_path, index=False)
-
-            update_task(task_id, {'progress': min(tasks[task_id]['progress'] + progress_step, 99)})
+        chunk_length = chunk_length_ms / 1000
+        # The lease keeps the store's garbage collector away from files in use
+        with artifact_store.lease(video['id']) as video_out_dir:
+            # Requests for the same video attach to the transcription already running in this
+            # process; the work lock makes other processes wait for it and reuse its transcript
+            def transcribe(flight):
+                with artifact_store.work_lock(video['id'], 'asr'):
+                    return _transcribe_video(video, video_out_dir, chunk_length, flight, on_words)
+
+            key = (video['id'], chunk_length, asr_chunk_seconds, asr_vad)
+            transcript_path, shared = asr_flights.run(key, transcribe, caller=task_id)
+            if shared:
+                print(f"Shared the transcription of {video['id']} with another request")
 
         update_task(task_id, {
             'progress': 100,
             'message': "Successfully processed the audio",
             'data': {
-                "chunk_length": chunk_length_ms / 1000,
-                "analysis_length": chunk_length_ms / 1000,
-                "transcription_dir": transcription_out_dir
+                "chunk_length": chunk_length,
+                "analysis_length": chunk_length,
+                "transcript_path": transcript_path,
+                "url": video['url'],
             },
         })
 
@@ -271,6 +512,7 @@ def _analyze_asr(video, task_id, chunk_length_ms=120 * 1000):
             'message': f"Error in analyze_asr: {str(e)}",
             'data': {}
         })
+    _collect_artifacts()
 
 @video_bp.route('/search_content', methods=['POST'])
 def search_content():
@@ -279,15 +521,29 @@ def search_content():
     metadata = data.get("metadata", {})
     if not query:
         return jsonify({"status": "error", "message": "Query is required"}), 400
+    if 'stop' in metadata:
+        try:
+            metadata = dict(metadata, stop=_parse_stop(metadata['stop']))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+    app = current_app._get_current_object()
+    if job_manager.loop is not None:
+        # The query is broken down on the event loop rather than in this request's thread; the search
+        # itself still needs a worker, so a full queue turns the request away right here
+        try:
+            if job_manager.queue_full():
+                raise QueueFullError(f"Job queue is full ({job_manager.max_queued} jobs waiting)")
+            task_id = job_manager.submit_async(lambda task_id: _search_content_async(app, task_id, query, metadata), {
+                "task_type": "search_content",
+                "progress": 0,
+                "message": "Processing the query",
+                "data": []
+            })
+        except QueueFullError as e:
+            return busy_response(e)
+        return jsonify({"status": "success", "task_id": task_id})
 
-    task_id = str(int(time.time()))
-    tasks[task_id] = {
-        "task_type": "search_content",
-        "status": "processing",
-        "progress": 0,
-        "message": "Processing the query",
-        "data": []
-    }
     result = overview_chain.process(query)
     if not result['success']:
         return jsonify({"status": "error", "message": "Failed to process the query"}), 400
@@ -297,69 +553,169 @@ def search_content():
         '4w1h': result['data']
     }
     # Start the background process
-    thread = Thread(target=_search_content, args=(current_app._get_current_object(), task_id, query, metadata))
-    thread.start()
+    try:
+        task_id = job_manager.submit(lambda task_id: _search_content(app, task_id, query, metadata), {
+            "task_type": "search_content",
+            "progress": 0,
+            "message": "Processing the query",
+            "data": []
+        }, priority=5)
+    except QueueFullError as e:
+        return busy_response(e)
     return jsonify({"status": "success", "task_id": task_id})
 
-def _search_content(app, task_id, query, metadata):
+async def _search_content_async(app, task_id, query, metadata):
+    """Break the query down on the event loop, then search the transcript on a job worker"""
+    result = await overview_chain.aprocess(query)
+    if not result['success']:
+        update_task(task_id, {
+            "status": "error",
+            "progress": 100,
+            "message": "Failed to process the query",
+            "data": []
+        })
+        return
+    query = {
+        'query': query,
+        '4w1h': result['data']
+    }
     try:
-        update_task(task_id, {'progress': 1})
-        chunk_length = metadata.get('chunk_length', 120)
-        analysis_length = metadata.get('analysis_length', 120)
-        transcription_dir = metadata.get('transcription_dir', '')
-        sliding_window = 0.5 * chunk_length
-        start_time = 0
-        search_results = []
-        transcripts = sorted(glob.glob(f"{transcription_dir}/*.csv"))
-
-        while start_time < len(transcripts) * chunk_length:
-            end_time = start_time + analysis_length - 1
-            start_chunk = transcripts[int(start_time / chunk_length)]
-            end_chunk = transcripts[min(int(end_time / chunk_length), len(transcripts) - 1)]
-
-            df = pd.read_csv(start_chunk)
-            if start_chunk != end_chunk:
-                next_df = pd.read_csv(end_chunk)
-                df = pd.concat([df, next_df], ignore_index=True)
-
-            analyze_df = df[(df['start'] >= start_time) & (df['end'] <= end_time)]
-            content = analyze_df['word'].values.tolist()
-            content_start_time = analyze_df['start'].values.tolist()
-            content_end_time = analyze_df['end'].values.tolist()
-            formatted_content = ''
-            for i in range(len(content)):
-                formatted_content += '(' + content[i] + ',' + str(content_start_time[i]) + ',' + str(content_end_time[i]) + ')'
-
-            search_result = search_content_chain.process(formatted_content, query['4w1h']['What'])
-            if search_result['success'] and 'None' not in str(search_result['data']['start_time']):
+        await job_manager.run_in_worker(lambda: _search_content(app, task_id, query, metadata), priority=5)
+    except QueueFullError as e:
+        update_task(task_id, {
+            "status": "error",
+            "progress": 100,
+            "message": f"Server is busy, please retry later: {str(e)}",
+            "data": []
+        })
+
+def _parse_stop(stop):
+    """A request's 'stop' options with their values parsed, raising ValueError on malformed ones"""
+    if stop is None:
+        return None
+    if not isinstance(stop, dict):
+        raise ValueError("stop must be an object")
+    parsed = {}
+    for name, value in stop.items():
+        if name not in search_stop:
+            raise ValueError(f"Unknown stop option: {name}")
+        if value is None:  # the server default
+            continue
+        try:
+            parsed[name] = type(search_stop[name])(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid stop option {name}: {value!r}")
+        if not parsed[name] >= 0:
+            raise ValueError(f"Invalid stop option {name}: {value!r}")
+    return parsed
+
+def _scan_budget(stop=None):
+    """`ScanBudget` from a request's parsed 'stop' options (see `_parse_stop`), falling back to the server defaults"""
+    options = dict(search_stop, **(stop or {}))
+    return ScanBudget(
+        max_hits=options.get('max_hits') or None,
+        min_relevance=float(options.get('min_relevance', 8)),
+        max_calls=options.get('max_calls') or None,
+        max_seconds=options.get('max_seconds') or None,
+    )
+
+def _screen_windows(task_id, query, metadata, transcript, analysis_length):
+    """Matches of the LLM in the prefiltered windows of a complete transcript, in time order"""
+    search_results = []
+    budget = _scan_budget(metadata.get('stop'))
+    with metrics.span('prefilter'):
+        # Overlapping windows of whole phrases, each with one timestamp per phrase and within the token budget
+        windows = pack_windows(transcript, metadata.get('token_budget', window_token_budget), max_length=analysis_length)
+        window_texts = [window.plain_text for window in windows]
+
+        # Only windows sharing vocabulary with the query go to the LLM, unless asked to scan everything
+        prefilter = metadata.get('prefilter', {})
+        selected = select_windows(
+            window_texts, query['query'], query['4w1h'],
+            top_k=prefilter.get('top_k', prefilter_top_k),
+            threshold=prefilter.get('threshold', 0.0),
+            scan_all=prefilter.get('scan_all', False),
+            # A scan that may stop early looks at the most promising windows first
+            by_score=budget.limited,
+        )
+    print(f"Screening {len(selected)} of {len(windows)} transcript windows")
+
+    # Screen the selected windows concurrently; a budget can end the scan before all of them are done
+    completed = []
+    def on_window_done(i, search_result):
+        completed.append(i)
+        update_task(task_id, {'progress': max(1, int(len(completed) / len(selected) * 90))})
+
+    window_results = search_content_chain.process_batch(
+        [windows[i].text for i in selected], query['4w1h']['What'],
+        max_concurrency=metadata.get('max_concurrency', search_concurrency),
+        on_result=on_window_done,
+        slot=lambda: resource_pools.slot('llm'),
+        budget=budget,
+    )
+    coverage = scan_coverage(windows, [i for i, search_result in zip(selected, window_results) if search_result is not None], budget)
+    update_task(task_id, {'coverage': coverage})
+    for i, search_result in sorted(zip(selected, window_results), key=lambda item: item[0]):
+        if search_result is not None and search_result['success'] and 'None' not in str(search_result['data']['start_time']):
+            times = windows[i].to_word_times(search_result['data']['start_time'], search_result['data']['end_time'])
+            if times is not None:
+                search_result['data']['start_time'], search_result['data']['end_time'] = times
                 search_results.append(search_result['data'])
-            start_time += sliding_window
 
-            progress = int((min(int(end_time / chunk_length)+1, len(transcripts) - 1) / len(transcripts)) * 90)
-            update_task(task_id, {'progress': progress})
+    return search_results
 
-        ranked_results = search_content_chain.ranking(search_results, query['query'])
+def _search_content(app, task_id, query, metadata, search_results=None):
+    # search_results, when given, are the matches an IncrementalSearch already screened
+    try:
+        update_task(task_id, {'progress': 1})
+        analysis_length = metadata.get('analysis_length', ANALYSIS_LENGTH)
+        transcript = TranscriptStore.load(metadata)
+        if search_results is None:
+            search_results = _screen_windows(task_id, query, metadata, transcript, analysis_length)
+
+        with resource_pools.slot('llm'):
+            ranked_results = search_content_chain.ranking(search_results, query['query'])
         update_task(task_id, {
             'progress': 99,
         })
-        out_dir = os.path.dirname(transcription_dir)
-        raw_video_path = os.path.join(out_dir, 'raw_video.mp4')
-        video = VideoFileClip(raw_video_path)
-        clip_dir = os.path.join(out_dir, 'clips')
-        if os.path.exists(clip_dir):
-            shutil.rmtree(clip_dir)
-        os.makedirs(clip_dir, exist_ok=True)
+        out_dir = os.path.dirname(transcript.path)
+        with artifact_store.lease(os.path.basename(out_dir)):
+            raw_video_path = os.path.join(out_dir, 'raw_video.mp4')
+            if os.path.exists(raw_video_path):
+                video_source = raw_video_path
+            else:
+                # The video was never downloaded: ffmpeg seeks into the stream with
+                # HTTP range requests and only fetches the ranked spans
+                with metrics.span('resolve_source'):
+                    video_source = YouTube(metadata['url']).streams.first().url
+            clip_dir = os.path.join(out_dir, 'clips')
+            os.makedirs(clip_dir, exist_ok=True)
 
-        with app.app_context():
             ranked_data = ranked_results['data']
             for rank_data in ranked_data:
-                start_t = int(float(rank_data['start_time']))
-                end_t = int(float(rank_data['end_time']))
-                video_clip = video.subclipped(start_t, end_t)
-                video_clip_path = os.path.join(clip_dir, f"{start_t}_{end_t}.mp4")
-                video_clip.write_videofile(video_clip_path, codec='libx264', audio_codec='aac')
+                # The moment's words as transcribed, next to the LLM's extract of them; the
+                # times are word times rounded to 10 ms, hence the tolerance
+                moment = transcript.window(float(rank_data['start_time']) - 0.01, float(rank_data['end_time']) + 0.01)
+                rank_data['transcript'] = moment.text
+            spans =[_clip_span(rank_data['start_time'], rank_data['end_time']) for rank_data in ranked_data]
+            video_clip_paths = [os.path.join(clip_dir, clip_renderer.clip_name(start, end)) for start, end in spans]
+            # Clips other searches already cut are reused; new ones are rendered aside and renamed
+            # into place, so concurrent searches never see (or delete) each other's half-written clips
+            missing = sorted({span for span, path in zip(spans, video_clip_paths) if not os.path.exists(path)})
+            if missing:
+                render_dir = temp_path(clip_dir)
+                try:
+                    with metrics.span('clip_render'):
+                        rendered = clip_renderer.render_many(video_source, missing, render_dir)
+                    for path in rendered:
+                        os.replace(path, os.path.join(clip_dir, os.path.basename(path)))
+                finally:
+                    shutil.rmtree(render_dir, ignore_errors=True)
+
+        with app.app_context():
+            for rank_data, video_clip_path in zip(ranked_data, video_clip_paths):
                 # Generate URL for the dynamically served downloads route
-                relative_path = os.path.relpath(video_clip_path, './downloads').replace('\\', '/')
+                relative_path = os.path.relpath(video_clip_path, download_dir).replace('\\', '/')
                 rank_data['video_clip_path'] = url_for('video_routes.serve_downloads', filename=relative_path, _external=True)
 
             update_task(task_id, {
@@ -375,10 +731,42 @@ def _search_content(app, task_id, query, metadata):
             'message': f"Error in search_content: {str(e)}",
             'data': []
         })
+    _collect_artifacts()
+
+def _collect_artifacts():
+    # Runs after the task is settled: a failed eviction must not turn a finished task into an error
+    try:
+        artifact_store.collect()
+    except Exception as e:
+        print("Error collecting artifacts: ", e)
+
+def _clip_span(start_time, end_time):
+    """Whole-second `(start, end)` of a clip covering the moment, at least one second long"""
+    start = int(float(start_time))
+    return start, max(math.ceil(float(end_time)), start + 1)
+
+@video_bp.route('/library/search', methods=['GET', 'POST'])
+def library_search():
+    """Moments matching a query in the transcripts of every video processed so far, without any network work"""
+    data = request.get_json(silent=True) or {}
+    query = data.get('query', request.args.get('query', ''))
+    if not query:
+        return jsonify({"status": "error", "message": "Query is required"}), 400
+    limit = int(data.get('limit', request.args.get('limit', 10)))
+    with metrics.span('library_search'):
+        moments = library_index.search(query, data.get('4w1h'), limit=limit)
+    return jsonify({"status": "success", "data": moments, "index": library_index.stats()})
+
+@video_bp.route('/llm_cache/stats', methods=['GET'])
+def llm_cache_stats():
+    return jsonify({"status": "success", "data": llm_cache.stats()}), 200
 
 @video_bp.route('/downloads/<path:filename>', methods=['GET'])
 def serve_downloads(filename):
-    return send_from_directory('./downloads', filename)
+    video_id = filename.split('/')[0]
+    if artifact_store.known(video_id):
+        artifact_store.touch(video_id)
+    return send_from_directory(download_dir, filename)
 
 @video_bp.route('/fetch', methods=['POST'])
 def fetch_video():
@@ -388,30 +776,24 @@ def fetch_video():
     if not youtube_url:
         return jsonify({"status": "error", "message": "YouTube URL is required"}), 400
 
-    task_id = str(int(time.time()))
-    with tasks_lock:
-        tasks[task_id] = {
+    try:
+        task_id = job_manager.submit(lambda task_id: _fetch_video(youtube_url, task_id), {
             "task_type": "fetch_video",
-            "status": "processing",
             "progress": 0,
             "message": "Processing the video",
-        }
-    
-    thread = Thread(target=_fetch_video, args=(youtube_url, task_id), daemon=True)
-    thread.start()
+        }, priority=0)
+    except QueueFullError as e:
+        return busy_response(e)
 
     return jsonify({"status": "success", "task_id": task_id})
 
 def _fetch_video(youtube_url, task_id):
     try:
-        yt = YouTube(youtube_url)
-        video_url = yt.streams.first().url
-        video_id = yt.video_id
-        video_title = yt.title
+        video = video_metadata.resolve(youtube_url)
 
         metadata = {
-            "title": video_title,
-            "id": video_id,
+            "title": video["title"],
+            "id": video["id"],
             "url": youtube_url
         }
 
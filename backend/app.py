@@ -1,12 +1,22 @@
 from flask_cors import CORS
-from flask import Flask, request, jsonify, Blueprint, send_from_directory
-from api.video_routes import video_bp
-
-app = Flask(__name__)
-CORS(app)
-app.register_blueprint(video_bp)
-app.config['SERVER_NAME'] = 'localhost:5000'
-app.config['PREFERRED_URL_SCHEME'] = 'http'
+from flask import Flask, Response, request, jsonify, Blueprint, send_from_directory
+from libs.metrics import metrics
+
+# ASR pool workers (ASR_MODE=pool) are spawned interpreters that import this script again, as
+# __mp_main__; only the web process itself sets up the routes and, through them, everything in init
+if __name__ != '__mp_main__':
+    from api.video_routes import video_bp
+
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(video_bp)
+    app.config['SERVER_NAME'] = 'localhost:5000'
+    app.config['PREFERRED_URL_SCHEME'] = 'http'
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        # Stage durations, LLM calls/tokens/retries and queue depth, for Prometheus to scrape
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == "__main__":
     app.run(debug=True)
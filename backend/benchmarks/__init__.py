@@ -0,0 +1,5 @@
+"""Offline benchmarks of the search, ASR, screening and clip pipeline.
+
+Run from the backend directory with `python -m benchmarks.run`; see
+`benchmarks/run.py --help` for the scenarios and fake latencies.
+"""
@@ -0,0 +1,181 @@
+import re
+import ast
+import json
+import time
+import zlib
+import random
+import asyncio
+import subprocess
+import numpy as np
+from threading import Lock
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import PrivateAttr
+from libs.audio_pipeline import SAMPLE_RATE, ffmpeg_binary
+from libs.search_yt_v2 import SearcYoutubeTask
+
+# The phrase the benchmark query asks for; FakeASR says it once per chunk
+TOPIC = "media day workout"
+BENCHMARK_QUERY = f"I want to find the clip where the player talks about the {TOPIC} in the gym."
+FILLER_WORDS = (
+    "we the team season game really think about coming back ball court night play coach "
+    "shot defense year guys lot good just going know time people great"
+).split()
+PHRASE_LINE = re.compile(r"^\[([0-9.]+)\](.*)$", re.M)
+SECTION_LINE = re.compile(r"^\[([0-9]+)\] ", re.M)
+
+
+def _between(text, start, end):
+    return text.split(start, 1)[1].split(end, 1)[0].strip()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for `ChatOpenAI` in the overview, search and ranking chains.
+
+    Recognizes which prompt it was given and answers in that prompt's
+    format after `latency` seconds plus `token_latency` per prompt token
+    (approximated as 4 characters).
+    """
+    latency: float = 0.3
+    token_latency: float = 0.0
+    _calls: list = PrivateAttr(default_factory=list)
+    _lock: Lock = PrivateAttr(default_factory=Lock)
+
+    @property
+    def _llm_type(self):
+        return 'fake-chat'
+
+    @property
+    def calls(self):
+        with self._lock:
+            return len(self._calls)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        with self._lock:
+            self._calls.append(len(prompt))
+        time.sleep(self.latency + self.token_latency * len(prompt) / 4)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.respond(prompt)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Waits on the event loop like a real API client, not on a thread of the default executor
+        prompt = messages[-1].content
+        with self._lock:
+            self._calls.append(len(prompt))
+        await asyncio.sleep(self.latency + self.token_latency * len(prompt) / 4)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.respond(prompt)))])
+
+    def respond(self, prompt):
+        if prompt.startswith("Analyze the query and extract"):
+            return json.dumps({"Who": "the player", "What": f"talks about the {TOPIC}", "When": "", "Where": "gym", "How": ""})
+        if prompt.startswith("Generate an optimized YouTube search query"):
+            return f"player \"{TOPIC}\""
+        if "which video might contains" in prompt:
+            videos = ast.literal_eval(_between(prompt, "Search Results:", "\nQuery:"))
+            return json.dumps({"ranked_results": videos})
+        if "extracting relevant sections from transcripts" in prompt:
+            return json.dumps(self._screen(_between(prompt, "[t]):\n", "\nWhat (Information to extract)")))
+        if "ranking sections of a video" in prompt:
+            return json.dumps({"ranked_ids": [int(i) for i in SECTION_LINE.findall(prompt)]})
+        raise ValueError(f"FakeChatModel got an unknown prompt: {prompt[:80]!r}")
+
+    def _screen(self, transcript):
+        lines = PHRASE_LINE.findall(transcript)
+        for i, (t, phrase) in enumerate(lines):
+            if TOPIC in phrase:
+                end = lines[min(i + 1, len(lines) - 1)][0]
+                return {"content": phrase.strip(), "info": f"Mentions the {TOPIC}", "start_time": t, "end_time": end, "relevance": 9}
+        return {"content": "None", "info": "None", "start_time": "None", "end_time": "None", "relevance": 0}
+
+
+class FakeYouTubeSearch(SearcYoutubeTask):
+    """`SearcYoutubeTask` whose Selenium search returns `num_videos` synthetic results after `latency` seconds."""
+    def __init__(self, llm, num_videos=3, latency=0.5, cache=None):
+        super().__init__(llm, cache=cache)
+        self.num_videos = num_videos
+        self.latency = latency
+
+    def search(self, search_query, max_results=20):
+        time.sleep(self.latency)
+        return self._results(search_query, max_results)
+
+    async def asearch(self, search_query, max_results=20):
+        await asyncio.sleep(self.latency)
+        return self._results(search_query, max_results)
+
+    def _results(self, search_query, max_results):
+        results = []
+        for i in range(min(self.num_videos, max_results)):
+            video_id = f"bench{zlib.crc32(f'{search_query}:{i}'.encode()) % 10 ** 6:06d}"
+            results.append({
+                'id': video_id,
+                'title': f"Benchmark video {i}",
+                'url': f"https://www.youtube.com/watch?v={video_id}",
+            })
+        return {
+            'success': True,
+            'data': results,
+            'message': 'Successfully fetched the search results.',
+        }
+
+
+class FakeASR:
+    """Stand-in for a Whisper model that "hears" one word per voiced 0.35s frame.
+
+    Words come from a filler vocabulary seeded by the audio itself, so the
+    same audio always gives the same transcript; the `TOPIC` phrase is said
+    once in every chunk. Takes `realtime_factor` seconds per second of audio.
+    """
+    FRAME = 0.35
+
+    def __init__(self, realtime_factor=0.02, words_per_sentence=12):
+        self.realtime_factor = realtime_factor
+        self.words_per_sentence = words_per_sentence
+
+    def transcribe(self, audio, **options):
+        time.sleep(len(audio) / SAMPLE_RATE * self.realtime_factor)
+        frame = int(self.FRAME * SAMPLE_RATE)
+        num_frames = len(audio) // frame
+        energy = np.sqrt(np.mean(audio[:num_frames * frame].reshape(num_frames, frame) ** 2, axis=1)) if num_frames else np.zeros(0)
+        rng = random.Random(zlib.crc32(audio[:SAMPLE_RATE].tobytes()))
+        voiced = [i for i in range(num_frames) if energy[i] > 0.02]
+        topic_at = len(voiced) * 2 // 5
+
+        segments, words = [], []
+        for n, i in enumerate(voiced):
+            if n == topic_at:
+                text = f" {TOPIC}"
+            else:
+                text = f" {rng.choice(FILLER_WORDS)}"
+            if len(words) == self.words_per_sentence - 1:
+                text += "."
+            words.append({'word': text, 'start': round(i * self.FRAME, 2), 'end': round((i + 0.9) * self.FRAME, 2)})
+            if len(words) == self.words_per_sentence:
+                segments.append({'text': ''.join(word['word'] for word in words), 'words': words})
+                words = []
+        if words:
+            segments.append({'text': ''.join(word['word'] for word in words), 'words': words})
+        return {'text': ''.join(segment['text'] for segment in segments), 'segments': segments}
+
+    def transcribe_batch(self, audios, **options):
+        return [self.transcribe(audio, **options) for audio in audios]
+
+
+def make_synthetic_video(path, duration, width=320, height=180, fps=25):
+    """Write an H.264/AAC test video with speech-like audio.
+
+    The audio is syllable-rate tone bursts with a short pause every 6s, and
+    the first 15s of every minute are silent, like breaks between interviews.
+    """
+    speech = "0.4*sin(2*PI*180*t)*gt(sin(2*PI*2.8*t),-0.2)*gt(mod(t,6),0.9)*gt(mod(t,60),15)"
+    result = subprocess.run([
+        ffmpeg_binary(), '-nostdin', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        '-f', 'lavfi', '-i', f"aevalsrc='{speech}':s=44100:d={duration}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(fps * 2),
+        '-c:a', 'aac', '-shortest', '-movflags', '+faststart', path,
+    ], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()}")
+    return path
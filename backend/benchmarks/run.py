@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from functools import partial
+from threading import Thread, Event
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from libs.scheduler import ResourcePools
+from libs.jobs import JobManager
+from libs.event_loop import EventLoop
+from libs.clips import ClipRenderer
+from libs.overview import OverviewTask
+from libs.search_content import SearchContentTask
+from libs.artifact_store import ArtifactStore
+from libs.library_index import LibraryIndex
+from libs.asr_pool import ProcessPoolASR
+from libs.llm_cache import LLMCache
+from libs.transcript_store import TRANSCRIPT_FILENAME
+from benchmarks.fakes import BENCHMARK_QUERY, FakeChatModel, FakeYouTubeSearch, FakeASR, make_synthetic_video
+
+DEFAULT_OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'latest.json')
+
+
+class RSSSampler:
+    """Peak resident set size of this process while the sampler is running, in MB.
+
+    Reads /proc/self/status every `interval` seconds; without /proc it
+    falls back to the process-wide high-water mark.
+    """
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = Event()
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self.thread = Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+class TimedClipRenderer(ClipRenderer):
+    """`ClipRenderer` that records how long each `render_many` call took."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.durations = []
+
+    def render_many(self, source, spans, out_dir):
+        start = time.perf_counter()
+        try:
+            return super().render_many(source, spans, out_dir)
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+
+def install_fake_init(work_dir, args):
+    """Register an `init` module wired to the fakes, before `api.video_routes` imports it."""
+    llm = FakeChatModel(latency=args.llm_latency, token_latency=args.llm_token_latency)
+    cache = LLMCache(os.path.join(work_dir, 'llm_cache.sqlite')) if args.llm_cache else None
+    init = types.ModuleType('init')
+    init.search_concurrency = args.search_concurrency
+    init.prefilter_top_k = args.prefilter_top_k
+    init.window_token_budget = 1500
+    init.streaming_search = args.streaming_search
+    init.search_stop = {'max_hits': args.max_hits, 'min_relevance': 8, 'max_calls': args.max_calls, 'max_seconds': 0}
+    init.video_concurrency = args.video_concurrency
+    init.resource_pools = ResourcePools(download=2, asr=1, llm=8)
+    init.job_manager = JobManager(
+        num_workers=4,
+        max_queued=max(32, args.concurrent_searches),
+        loop=EventLoop('requests') if args.async_requests else None,
+        max_in_flight=max(1024, args.concurrent_searches),
+    )
+    init.artifact_store = ArtifactStore(os.path.join(work_dir, 'downloads'), max_bytes=1024 ** 4)
+    init.library_index = LibraryIndex(os.path.join(work_dir, 'library_index.sqlite'))
+    init.clip_renderer = TimedClipRenderer()
+    init.video_metadata = None  # videos are always found locally, nothing to resolve
+    init.acquisition_mode = 'full'
+    init.asr_vad = args.asr_vad
+    init.asr_vad_min_speech = 0.1
+    init.asr_chunk_seconds = args.asr_chunk_seconds
+    init.asr_batch_size = args.asr_batch_size
+    if args.asr_workers:
+        init.asr_model = ProcessPoolASR(partial(FakeASR, realtime_factor=args.asr_rtf), num_workers=args.asr_workers, threads_per_worker=1)
+        init.asr_batch_size = max(args.asr_batch_size, args.asr_workers)
+    else:
+        init.asr_model = FakeASR(realtime_factor=args.asr_rtf)
+    init.global_llm = llm
+    init.llm_cache = cache
+    init.overview_chain = OverviewTask(llm, cache=cache)
+    init.search_content_chain = SearchContentTask(llm, cache=cache)
+    init.search_youtube = FakeYouTubeSearch(llm, latency=args.search_latency, cache=cache)
+    sys.modules['init'] = init
+    return init
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(video_routes, record, target):
+    """Run `target(task_id)` synchronously on a fresh task record, returns (seconds, peak RSS MB, task).
+
+    The task's 'first_result_seconds' is when it first had (partial) results.
+    """
+    task_id = f"bench-{time.perf_counter_ns()}"
+    with video_routes.tasks_lock:
+        video_routes.tasks[task_id] = dict(record, status='processing', progress=0, message='', data=[])
+    first_result = []
+    done = Event()
+
+    def watch():
+        while not done.wait(0.01):
+            task = video_routes.get_task(task_id)
+            if task.get('partial_data'):
+                first_result.append(time.perf_counter() - start)
+                return
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        watcher = Thread(target=watch, daemon=True)
+        watcher.start()
+        target(task_id)
+        seconds = time.perf_counter() - start
+        done.set()
+        watcher.join()
+    task = video_routes.get_task(task_id)
+    if task['status'] == 'error':
+        raise RuntimeError(task['message'])
+    task['first_result_seconds'] = round(first_result[0] if first_result else seconds, 3)
+    return seconds, rss.peak, task
+
+
+def run_scenario(init, video_routes, app, media_dir, video_length, num_videos):
+    init.search_youtube.num_videos = num_videos
+    calls_before = init.global_llm.calls
+    stages = {}
+
+    def record(name, seconds, peak):
+        stage = stages.setdefault(name, {'seconds': 0.0, 'peak_rss_mb': 0.0})
+        stage['seconds'] += seconds
+        stage['peak_rss_mb'] = round(max(stage['peak_rss_mb'], peak), 1)
+
+    if init.job_manager.loop is not None:
+        search = lambda task_id: init.job_manager.loop.run(video_routes._advanced_search_async(task_id, BENCHMARK_QUERY))
+    else:
+        search = lambda task_id: video_routes._advanced_search(task_id, BENCHMARK_QUERY)
+    seconds, peak, task = run_stage(video_routes, {'task_type': 'advanced_search'}, search)
+    record('advanced_search', seconds, peak)
+    videos, query = task['data']['videos'], task['data']['query']
+
+    source = os.path.join(media_dir, f"{video_length}s.mp4")
+    if not os.path.exists(source):
+        make_synthetic_video(source, video_length)
+    for video in videos:
+        video_dir = init.artifact_store.video_dir(video['id'])
+        shutil.rmtree(video_dir, ignore_errors=True)
+        os.makedirs(video_dir)
+        os.link(source, os.path.join(video_dir, 'raw_video.mp4'))
+
+    # Each stage on its own, one video after the other
+    for video in videos:
+        seconds, peak, task = run_stage(video_routes, {'task_type': 'analyze_asr'},
+                                        lambda task_id: video_routes._analyze_asr(video, task_id))
+        record('analyze_asr', seconds, peak)
+        metadata = task['data']
+        clip_durations = len(init.clip_renderer.durations)
+        seconds, peak, task = run_stage(video_routes, {'task_type': 'search_content'},
+                                        lambda task_id: video_routes._search_content(app, task_id, query, metadata))
+        clip_seconds = sum(init.clip_renderer.durations[clip_durations:])
+        record('search_content', seconds - clip_seconds, peak)
+        record('clip_extraction', clip_seconds, peak)
+
+    # The whole /analyze job, videos processed concurrently, from scratch
+    for video in videos:
+        os.remove(os.path.join(init.artifact_store.video_dir(video['id']), TRANSCRIPT_FILENAME))
+        shutil.rmtree(os.path.join(init.artifact_store.video_dir(video['id']), 'clips'), ignore_errors=True)
+    seconds, peak, task = run_stage(video_routes, {'task_type': 'analyze'},
+                                    lambda task_id: video_routes._analyze(app, videos, task_id, query))
+    record('analyze', seconds, peak)
+
+    for stage in stages.values():
+        stage['seconds'] = round(stage['seconds'], 3)
+    return {
+        'video_length': video_length,
+        'num_videos': num_videos,
+        'stages': stages,
+        'throughput': {
+            'videos_per_minute': round(num_videos / seconds * 60, 2),
+            'audio_seconds_per_second': round(num_videos * video_length / seconds, 1),
+        },
+        'first_result_seconds': task['first_result_seconds'],
+        'clips': len(task['data']),
+        'llm_calls': init.global_llm.calls - calls_before,
+    }
+
+
+def run_concurrent_searches(init, video_routes, num_searches):
+    """Submit `num_searches` advanced searches at once, as the endpoint does, and time until all are done."""
+    job_manager = init.job_manager
+    start = time.perf_counter()
+    with RSSSampler() as rss:
+        if job_manager.loop is not None:
+            task_ids = [job_manager.submit_async(lambda task_id: video_routes._advanced_search_async(task_id, BENCHMARK_QUERY), {'task_type': 'advanced_search'})
+                        for _ in range(num_searches)]
+        else:
+            task_ids = [job_manager.submit(lambda task_id: video_routes._advanced_search(task_id, BENCHMARK_QUERY), {'task_type': 'advanced_search'}, priority=0)
+                        for _ in range(num_searches)]
+        for task_id in task_ids:
+            task = video_routes.get_task(task_id)
+            while 'finished_at' not in task:
+                task = job_manager.wait_for_change(task_id, task['version'])
+            if task['status'] == 'error':
+                raise RuntimeError(task['message'])
+    seconds = time.perf_counter() - start
+    return {
+        'searches': num_searches,
+        'seconds': round(seconds, 3),
+        'searches_per_second': round(num_searches / seconds, 1),
+        'peak_rss_mb': round(rss.peak, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Stages that got slower than `baseline` by more than `tolerance` (a fraction), as printable lines."""
+    previous = {(s['video_length'], s['num_videos']): s for s in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        old = previous.get((scenario['video_length'], scenario['num_videos']))
+        if old is None:
+            continue
+        for name, stage in scenario['stages'].items():
+            old_seconds = old['stages'].get(name, {}).get('seconds')
+            if old_seconds and stage['seconds'] > old_seconds * (1 + tolerance):
+                regressions.append(
+                    f"{name} ({scenario['video_length']}s x {scenario['num_videos']}): "
+                    f"{old_seconds:.2f}s -> {stage['seconds']:.2f}s (+{(stage['seconds'] / old_seconds - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with fake LLM, YouTube and ASR")
+    parser.add_argument('--lengths', type=int, nargs='+', default=[120, 600, 1800], help='Synthetic video lengths in seconds')
+    parser.add_argument('--videos', type=int, nargs='+', default=[1, 3], help='Number of videos found by the search')
+    parser.add_argument('--llm_latency', type=float, default=0.3, help='Seconds per fake LLM call')
+    parser.add_argument('--llm_token_latency', type=float, default=0.0, help='Extra seconds per prompt token')
+    parser.add_argument('--llm_cache', action='store_true', help='Cache LLM responses, as in production')
+    parser.add_argument('--search_latency', type=float, default=0.5, help='Seconds per fake YouTube search')
+    parser.add_argument('--asr_vad', default='auto', help="Voice activity detection in front of ASR ('auto', 'webrtc', 'energy'), 'off' to transcribe everything")
+    parser.add_argument('--asr_chunk_seconds', type=float, default=30, help='Maximum length of an ASR chunk')
+    parser.add_argument('--asr_batch_size', type=int, default=8, help='ASR chunks transcribed per batch')
+    parser.add_argument('--asr_workers', type=int, default=0, help='Shard ASR over this many processes (0 transcribes in-process)')
+    parser.add_argument('--asr_rtf', type=float, default=0.02, help='Fake ASR seconds per second of audio')
+    parser.add_argument('--no_streaming_search', dest='streaming_search', action='store_false', help='Search the transcript only once ASR is done')
+    parser.add_argument('--max_hits', type=int, default=0, help='Stop screening a video after this many confident matches (0 scans every selected window)')
+    parser.add_argument('--max_calls', type=int, default=0, help='Screen at most this many windows per video (0 for no limit)')
+    parser.add_argument('--async_requests', action='store_true', help='Run advanced searches as coroutines on one event loop')
+    parser.add_argument('--concurrent_searches', type=int, default=0, help='Also time this many advanced searches submitted at once')
+    parser.add_argument('--search_concurrency', type=int, default=4)
+    parser.add_argument('--prefilter_top_k', type=int, default=8)
+    parser.add_argument('--video_concurrency', type=int, default=3)
+    parser.add_argument('--work_dir', default=None, help='Where synthetic videos and artifacts go (a temporary directory by default)')
+    parser.add_argument('-o', '--out', default=DEFAULT_OUT, help='Where to save the JSON results (benchmarks/results/ is ignored by git)')
+    parser.add_argument('--baseline', default=None, help='Earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown over the baseline reported as a regression')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='youclipai-bench-')
+    media_dir = os.path.join(work_dir, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+    init = install_fake_init(work_dir, args)
+
+    from flask import Flask
+    import api.video_routes as video_routes
+    app = Flask(__name__)
+    app.config['SERVER_NAME'] = 'localhost'
+    app.register_blueprint(video_routes.video_bp)
+
+    results = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('out', 'baseline', 'work_dir')},
+        'scenarios': [],
+    }
+    try:
+        # One-off costs (imports, tokenizer and codec setup) shouldn't land in the first scenario
+        run_scenario(init, video_routes, app, media_dir, 30, 1)
+        for video_length in args.lengths:
+            for num_videos in args.videos:
+                print(f"Benchmarking {num_videos} video(s) of {video_length}s ...")
+                scenario = run_scenario(init, video_routes, app, media_dir, video_length, num_videos)
+                results['scenarios'].append(scenario)
+                for name, stage in scenario['stages'].items():
+                    print(f"  {name:<16} {stage['seconds']:8.2f}s  peak RSS {stage['peak_rss_mb']:.0f} MB")
+                print(f"  {scenario['throughput']['videos_per_minute']} videos/min, {scenario['llm_calls']} LLM calls, "
+                      f"first result after {scenario['first_result_seconds']:.2f}s")
+        if args.concurrent_searches:
+            print(f"Benchmarking {args.concurrent_searches} concurrent advanced searches ...")
+            results['concurrent_searches'] = run_concurrent_searches(init, video_routes, args.concurrent_searches)
+            print(f"  {results['concurrent_searches']['seconds']:.2f}s, "
+                  f"{results['concurrent_searches']['searches_per_second']} searches/s")
+    finally:
+        if hasattr(init.asr_model, 'shutdown'):
+            init.asr_model.shutdown()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    results['peak_child_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,123 @@ from libs.overview import OverviewTask
 from libs.search_content import SearchContentTask
 # from libs.search_yt import SearcYoutubeTask
 from libs.search_yt_v2 import SearcYoutubeTask
+from libs.scheduler import ResourcePools
+from libs.jobs import JobManager
+from libs.event_loop import EventLoop
+from libs.llm_cache import LLMCache
+from libs.clips import ClipRenderer
+from libs.video_metadata import VideoMetadataCache, VideoMetadataResolver
+from libs.asr_service import LocalASR, connect_or_start, load_authkey
+from libs.asr_pool import ProcessPoolASR
+from libs.artifact_store import ArtifactStore
+from libs.library_index import LibraryIndex, index_downloads
+from libs.metrics import metrics
+from libs.vad import make_detector
 from dotenv import load_dotenv
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 YouTube_API_KEY = os.getenv('YouTube_API_KEY')
+# Maximum number of transcript windows screened by the LLM at the same time
+search_concurrency = int(os.getenv('SEARCH_CONTENT_CONCURRENCY', 4))
+# Number of best-matching transcript windows (by BM25) screened by the LLM per video
+prefilter_top_k = int(os.getenv('PREFILTER_TOP_K', 8))
+# Upper bound on transcript tokens sent in one screening prompt
+window_token_budget = int(os.getenv('WINDOW_TOKEN_BUDGET', 1500))
+# /analyze screens transcript windows while the rest of the video is still being transcribed
+streaming_search = os.getenv('STREAMING_SEARCH', '1').lower() not in ('0', 'false', 'no')
+# Content search stops early after SEARCH_MAX_HITS matches the LLM rated at least SEARCH_MIN_RELEVANCE
+# (0-10), SEARCH_MAX_CALLS screened windows or SEARCH_MAX_SECONDS; 0 means no limit. Requests can
+# override these with their 'stop' options
+search_stop = {
+    'max_hits': int(os.getenv('SEARCH_MAX_HITS', 0)),
+    'min_relevance': float(os.getenv('SEARCH_MIN_RELEVANCE', 8)),
+    'max_calls': int(os.getenv('SEARCH_MAX_CALLS', 0)),
+    'max_seconds': float(os.getenv('SEARCH_MAX_SECONDS', 0)),
+}
+# Number of videos /analyze works on at once, and the slots shared by all of them
+video_concurrency = int(os.getenv('VIDEO_CONCURRENCY', 3))
+resource_pools = ResourcePools(
+    download=int(os.getenv('DOWNLOAD_SLOTS', 2)),
+    asr=int(os.getenv('ASR_SLOTS', 1)),
+    llm=int(os.getenv('LLM_SLOTS', 8)),
+)
+# Background jobs: worker threads, how many jobs may wait, and how long finished tasks are kept.
+# With ASYNC_REQUESTS, /advanced_search and /search_content wait on the LLM and YouTube on one shared
+# event loop instead of a worker thread each, up to ASYNC_MAX_REQUESTS at once
+async_requests = os.getenv('ASYNC_REQUESTS', '1').lower() not in ('0', 'false', 'no')
+job_manager = JobManager(
+    num_workers=int(os.getenv('JOB_WORKERS', 4)),
+    max_queued=int(os.getenv('JOB_QUEUE_SIZE', 32)),
+    ttl=int(os.getenv('TASK_TTL', 600)),
+    loop=EventLoop('requests') if async_requests else None,
+    max_in_flight=int(os.getenv('ASYNC_MAX_REQUESTS', 1024)),
+)
+metrics.gauge('job_queue_depth', job_manager.queue_depth, help="Jobs waiting for a worker")
+metrics.gauge('async_jobs', lambda: job_manager.in_flight, help="Coroutine jobs running on the event loop")
+metrics.gauge('tasks', lambda: len(job_manager.tasks), help="Task records held by the job manager")
+# Per-video downloads, transcripts and clips, garbage collected down to ARTIFACT_STORE_MAX_GB
+artifact_store = ArtifactStore('./downloads', max_bytes=int(float(os.getenv('ARTIFACT_STORE_MAX_GB', 20)) * 1024 ** 3))
+# Inverted index over every stored transcript, searched locally before going to YouTube; transcripts
+# already in the downloads folder are indexed at startup
+library_index = LibraryIndex(os.getenv('LIBRARY_INDEX_PATH', './cache/library_index.sqlite'))
+index_downloads(library_index, artifact_store.root)
+# Clips are cut by parallel ffmpeg processes, one per clip up to CLIP_WORKERS
+clip_renderer = ClipRenderer(max_workers=int(os.getenv('CLIP_WORKERS', os.cpu_count() or 1)))
+# YouTube metadata (title, length, publish time, streams) is resolved concurrently and cached on disk
+video_metadata = VideoMetadataResolver(
+    VideoMetadataCache(os.getenv('VIDEO_METADATA_CACHE_PATH', './cache/video_metadata.sqlite'),
+                       ttl=int(os.getenv('VIDEO_METADATA_TTL', 7 * 24 * 3600))),
+    max_workers=int(os.getenv('VIDEO_METADATA_WORKERS', 8)),
+)
+# 'audio_only' transcribes the smallest audio stream and fetches video spans only for ranked clips,
+# 'full' downloads the whole video up front
+acquisition_mode = os.getenv('ACQUISITION_MODE', 'audio_only')
+# 'service' shares one Whisper model between all web workers through a local ASR process,
+# 'local' loads the model inside this process, 'pool' shards chunks over ASR_WORKERS processes
+# with ASR_WORKER_THREADS torch threads and a model each (CPU-only machines with many cores).
+# ASR_SERVICE_PROCESSES > 1 runs such a pool inside the shared service. The service's authkey is
+# ASR_SERVICE_AUTHKEY, or a random key generated into ASR_SERVICE_KEY_FILE (mode 0600) on first start
+asr_mode = os.getenv('ASR_MODE', 'service')
+if asr_mode == 'service':
+    asr_model = connect_or_start(
+        ('127.0.0.1', int(os.getenv('ASR_SERVICE_PORT', 50051))),
+        load_authkey(os.getenv('ASR_SERVICE_KEY_FILE', './cache/asr_service.key')),
+        model_name=os.getenv('ASR_MODEL', 'turbo'),
+        max_concurrency=int(os.getenv('ASR_SERVICE_CONCURRENCY', 1)),
+        max_batch=int(os.getenv('ASR_SERVICE_MAX_BATCH', 8)),
+        processes=int(os.getenv('ASR_SERVICE_PROCESSES', 1)),
+        threads_per_process=int(os.getenv('ASR_WORKER_THREADS', 4)),
+    )
+elif asr_mode == 'pool':
+    asr_model = ProcessPoolASR.whisper(
+        os.getenv('ASR_MODEL', 'turbo'),
+        num_workers=int(os.getenv('ASR_WORKERS', 0)) or None,
+        threads_per_worker=int(os.getenv('ASR_WORKER_THREADS', 4)),
+    )
+else:
+    asr_model = LocalASR(os.getenv('ASR_MODEL', 'turbo'))
+# Voice activity detection in front of ASR: 'auto' (WebRTC when installed, else off), 'webrtc',
+# 'energy', or 'off' to transcribe fixed-length chunks of all audio. Blocks of which the VAD keeps
+# less than ASR_VAD_MIN_SPEECH are transcribed unfiltered
+asr_vad = os.getenv('ASR_VAD', 'auto')
+asr_vad_min_speech = float(os.getenv('ASR_VAD_MIN_SPEECH', 0.1))
+# ASR chunks are at most ASR_CHUNK_SECONDS long (one 30s Whisper window by default), and up to
+# ASR_BATCH_SIZE of them are transcribed in one batched forward pass
+asr_chunk_seconds = float(os.getenv('ASR_CHUNK_SECONDS', 30))
+asr_batch_size = int(os.getenv('ASR_BATCH_SIZE', 8))
+if asr_mode == 'pool':
+    # Every worker needs a shard of each batch
+    asr_batch_size = max(asr_batch_size, asr_model.num_workers)
+make_detector(asr_vad, asr_vad_min_speech)  # fail at startup on an unknown mode or a missing webrtcvad
 global_llm = ChatOpenAI(name="gpt-4o", temperature=0, max_tokens=512)
+# Parsed LLM responses are cached on disk, keyed by model, rendered prompt and parser
+llm_cache = LLMCache(
+    os.getenv('LLM_CACHE_PATH', './cache/llm_cache.sqlite'),
+    max_bytes=int(os.getenv('LLM_CACHE_MAX_MB', 256)) * 1024 * 1024,
+)
 
-overview_chain = OverviewTask(global_llm)
-search_content_chain = SearchContentTask(global_llm)
+overview_chain = OverviewTask(global_llm, cache=llm_cache)
+search_content_chain = SearchContentTask(global_llm, cache=llm_cache)
 # searcher = SearcYoutubeTask(YouTube_API_KEY, global_llm)
-search_youtube = SearcYoutubeTask(global_llm)
+search_youtube = SearcYoutubeTask(global_llm, cache=llm_cache, metadata_resolver=video_metadata)
@@ -0,0 +1,194 @@
+import os
+import glob
+import time
+import uuid
+import shutil
+from threading import Lock
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: leases only protect against this process
+    fcntl = None
+
+# Artifact classes in eviction order, each with the globs (relative to a
+# video's directory) that belong to it. Transcripts are kept the longest.
+ARTIFACT_CLASSES = [
+    ('chunks', ['chunks']),
+    ('raw_audio', ['raw_audio.*']),
+    ('partial', ['*.part', '*.tmp']),
+    ('raw_video', ['raw_video.mp4']),
+    ('clips', ['clips']),
+    ('transcripts', ['transcript.bin', 'transcriptions']),
+]
+LOCK_FILENAME = '.lock'
+ACCESS_FILENAME = '.last_access'
+
+
+def temp_path(path, suffix='.tmp'):
+    """A unique sibling of `path` to write to before renaming it into place.
+
+    Concurrent writers of the same artifact never share a temporary file,
+    and leftovers of crashed writers belong to the 'partial' class.
+    """
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def _size(path):
+    if os.path.isfile(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ArtifactStore:
+    """Size-bounded store of per-video artifacts under `root/<video_id>/`.
+
+    Work on a video happens inside `lease(video_id)`, which records the
+    access and holds a shared lock on the video directory (across processes
+    where `fcntl` is available). `collect` evicts artifacts until the store
+    fits in `max_bytes`: cheapest-to-recreate classes first, least recently
+    used videos first within a class, never touching a leased video.
+    """
+    def __init__(self, root='./downloads', max_bytes=20 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.leases = {}
+        os.makedirs(root, exist_ok=True)
+
+    def video_dir(self, video_id):
+        return os.path.join(self.root, video_id)
+
+    def known(self, video_id):
+        """Whether `video_id` names a video directory of this store (one that was ever leased)."""
+        if not video_id or video_id in ('.', '..') or os.path.basename(video_id) != video_id:
+            return False
+        return os.path.exists(os.path.join(self.video_dir(video_id), LOCK_FILENAME))
+
+    def touch(self, video_id):
+        video_dir = self.video_dir(video_id)
+        if os.path.isdir(video_dir):
+            try:
+                with open(os.path.join(video_dir, ACCESS_FILENAME), 'w') as f:
+                    f.write(str(time.time()))
+            except FileNotFoundError:  # the directory was removed meanwhile
+                pass
+
+    def last_access(self, video_id):
+        try:
+            return os.path.getmtime(os.path.join(self.video_dir(video_id), ACCESS_FILENAME))
+        except OSError:
+            return 0.0
+
+    @contextmanager
+    def lease(self, video_id):
+        """Protect a video's artifacts from eviction while they are in use."""
+        video_dir = self.video_dir(video_id)
+        os.makedirs(video_dir, exist_ok=True)
+        with self.lock:
+            self.leases[video_id] = self.leases.get(video_id, 0) + 1
+        lock_file = open(os.path.join(video_dir, LOCK_FILENAME), 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+            self.touch(video_id)
+            yield video_dir
+        finally:
+            self.touch(video_id)
+            lock_file.close()
+            with self.lock:
+                self.leases[video_id] -= 1
+                if self.leases[video_id] == 0:
+                    del self.leases[video_id]
+
+    @contextmanager
+    def work_lock(self, video_id, name):
+        """Hold the exclusive lock on one kind of work on a video (e.g. 'asr'), across processes.
+
+        Whoever gets the lock after another holder finds that holder's
+        finished artifacts instead of producing them a second time.
+        """
+        video_dir = self.video_dir(video_id)
+        os.makedirs(video_dir, exist_ok=True)
+        lock_file = open(os.path.join(video_dir, f".{name}{LOCK_FILENAME}"), 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            lock_file.close()
+
+    @contextmanager
+    def _exclusive(self, video_id):
+        """Yields whether the video could be locked for eviction without waiting."""
+        with self.lock:
+            if video_id in self.leases:
+                yield False
+                return
+        try:
+            lock_file = open(os.path.join(self.video_dir(video_id), LOCK_FILENAME), 'a')
+        except FileNotFoundError:  # the video directory was removed meanwhile
+            yield False
+            return
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+        finally:
+            lock_file.close()
+
+    def artifacts(self):
+        """All evictable artifacts as (class rank, last access, video id, path, size)."""
+        artifacts = []
+        for video_id in os.listdir(self.root):
+            video_dir = self.video_dir(video_id)
+            if not os.path.isdir(video_dir):
+                continue
+            last_access = self.last_access(video_id)
+            for rank, (_, patterns) in enumerate(ARTIFACT_CLASSES):
+                for pattern in patterns:
+                    for path in glob.glob(os.path.join(video_dir, pattern)):
+                        artifacts.append((rank, last_access, video_id, path, _size(path)))
+        return artifacts
+
+    def usage(self):
+        return sum(artifact[4] for artifact in self.artifacts())
+
+    def collect(self):
+        """Evict artifacts until the store fits its budget, returns the evicted paths."""
+        artifacts = sorted(self.artifacts())
+        total = sum(artifact[4] for artifact in artifacts)
+        evicted = []
+        for _, _, video_id, path, size in artifacts:
+            if total <= self.max_bytes:
+                break
+            with self._exclusive(video_id) as acquired:
+                if not acquired:
+                    continue
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    # Removed by another process's collector or a writer's cleanup meanwhile
+                    total -= size
+                    continue
+            total -= size
+            evicted.append(path)
+            print(f"Evicted {path} ({size / 1024 ** 2:.1f} MB)")
+        return evicted
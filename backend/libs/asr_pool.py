@@ -0,0 +1,105 @@
+import os
+import multiprocessing
+from functools import partial
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+
+_worker_asr = None
+
+
+def _start_worker(factory, num_threads):
+    global _worker_asr
+    # Set before torch is imported, so its OpenMP/MKL pools are sized for one shard
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    os.environ['MKL_NUM_THREADS'] = str(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+    _worker_asr = factory()
+    if hasattr(_worker_asr, 'load'):
+        _worker_asr.load()
+
+
+def _transcribe_shard(audios, options):
+    return _worker_asr.transcribe_batch(audios, **options)
+
+
+def local_whisper(model_name):
+    """Factory of the Whisper model each pool worker holds."""
+    from libs.asr_service import LocalASR
+    return LocalASR(model_name)
+
+
+def shard(lengths, num_shards):
+    """Split item indices into up to `num_shards` shards of about equal total length, each in input order.
+
+    Longest items are placed first, each into the currently lightest shard.
+    """
+    shards = [[] for _ in range(min(num_shards, len(lengths)))]
+    loads = [0] * len(shards)
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(i)
+        loads[lightest] += lengths[i]
+    return [sorted(indices) for indices in shards if indices]
+
+
+class ProcessPoolASR:
+    """ASR sharded over `num_workers` processes, each holding its own model.
+
+    PyTorch's intra-op threads stop paying off after a few cores for
+    Whisper decoding, so on CPU-only machines several small models beat
+    one big one: every worker runs `threads_per_worker` torch threads and
+    `transcribe_batch` hands each worker a shard of the chunks, balanced
+    by audio length. Results come back in input order and times stay
+    relative to each chunk, exactly as from a single model. Every worker
+    keeps a copy of the model in memory.
+
+    The processes are started by the first transcription, not when the
+    pool is created: spawned workers import the parent's `__main__`
+    again, which must not happen while that module is being imported.
+    """
+    def __init__(self, factory, num_workers=None, threads_per_worker=4):
+        self.factory = factory
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 1) // self.threads_per_worker)
+        self.lock = Lock()
+        self.executor = None
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Fresh interpreters: forking a process that already runs threads (and maybe torch) isn't safe
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_start_worker,
+                    initargs=(self.factory, self.threads_per_worker),
+                )
+            return self.executor
+
+    @classmethod
+    def whisper(cls, model_name='turbo', num_workers=None, threads_per_worker=4):
+        return cls(partial(local_whisper, model_name), num_workers, threads_per_worker)
+
+    def transcribe(self, audio, **options):
+        return self._executor().submit(_transcribe_shard, [audio], options).result()[0]
+
+    def transcribe_batch(self, audios, **options):
+        results = [None] * len(audios)
+        shards = shard([len(audio) for audio in audios], self.num_workers)
+        executor = self._executor()
+        futures = [(indices, executor.submit(_transcribe_shard, [audios[i] for i in indices], options)) for indices in shards]
+        for indices, future in futures:
+            for i, result in zip(indices, future.result()):
+                results[i] = result
+        return results
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,253 @@
+import os
+import sys
+import time
+import queue
+import secrets
+import tempfile
+import subprocess
+from threading import Thread, Event, Lock, local
+from multiprocessing.managers import BaseManager
+
+
+class LocalASR:
+    """Whisper model owned by the current process, loaded on first use.
+
+    Calls from different threads are serialized, a Whisper model isn't
+    safe to run concurrently. `transcribe_batch` encodes and decodes clips
+    of up to 30s together (see `libs.whisper_batch`).
+    """
+    def __init__(self, model_name='turbo'):
+        self.model_name = model_name
+        self.model = None
+        self.lock = Lock()
+        self.batching = True
+
+    def load(self):
+        if self.model is None:
+            import whisper
+            self.model = whisper.load_model(self.model_name)
+        return self.model
+
+    def transcribe(self, audio, **options):
+        with self.lock:
+            return self.load().transcribe(audio, **options)
+
+    def transcribe_batch(self, audios, **options):
+        with self.lock:
+            model = self.load()
+            if self.batching:
+                try:
+                    from libs.whisper_batch import transcribe_batch
+                    return transcribe_batch(model, audios, **options)
+                except (ImportError, AttributeError, TypeError) as e:
+                    # Batching relies on Whisper internals, an incompatible version gets the plain loop
+                    print(f"Batched transcription unavailable, transcribing one by one: {e}")
+                    self.batching = False
+            return [model.transcribe(audio, **options) for audio in audios]
+
+
+class _Job:
+    def __init__(self, audio, options):
+        self.audio = audio
+        self.options = options
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class ASRServer:
+    """Model-owning side of the ASR service.
+
+    Jobs submitted by any number of clients are queued; `max_concurrency`
+    runner threads each take up to `max_batch` jobs with identical options
+    (waiting at most `batch_wait` seconds for a batch to fill) and hand them
+    to the model together. With `processes` > 1 the model is a
+    `ProcessPoolASR` sharding every batch over that many processes.
+    """
+    def __init__(self, model_name='turbo', max_concurrency=1, max_batch=8, batch_wait=0.05, processes=1, threads_per_process=4):
+        if processes > 1:
+            from libs.asr_pool import ProcessPoolASR
+            self.asr = ProcessPoolASR.whisper(model_name, num_workers=processes, threads_per_worker=threads_per_process)
+        else:
+            self.asr = LocalASR(model_name)
+            self.asr.load()
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.jobs = queue.Queue()
+        for _ in range(max_concurrency):
+            Thread(target=self._run, daemon=True).start()
+
+    def transcribe(self, audio, options=None):
+        job = _Job(audio, options or {})
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise RuntimeError(job.error)
+        return job.result
+
+    def transcribe_many(self, audios, options=None):
+        """Queue all `audios` at once so they can share batches, returns their results in order."""
+        jobs = [_Job(audio, options or {}) for audio in audios]
+        for job in jobs:
+            self.jobs.put(job)
+        for job in jobs:
+            job.done.wait()
+        errors = [job.error for job in jobs if job.error is not None]
+        if errors:
+            raise RuntimeError(errors[0])
+        return [job.result for job in jobs]
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.time() + self.batch_wait
+        while len(batch) < self.max_batch:
+            try:
+                job = self.jobs.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if job.options != batch[0].options:
+                # Different decoding options can't share a batch, leave it for the next one
+                self.jobs.put(job)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.asr.transcribe_batch([job.audio for job in batch], **batch[0].options)
+                for job, result in zip(batch, results):
+                    job.result = result
+            except Exception as e:
+                for job in batch:
+                    job.error = str(e)
+            for job in batch:
+                job.done.set()
+
+
+class ASRManager(BaseManager):
+    pass
+
+
+class ASRClient:
+    """Submits transcription jobs to a shared `ASRServer` over a local socket.
+
+    Exposes the same `transcribe(audio, **options)` call as a Whisper model.
+    """
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.local = local()
+
+    def _server(self):
+        # Manager proxies are not thread-safe, each thread gets its own connection
+        if getattr(self.local, 'server', None) is None:
+            manager = ASRManager(address=self.address, authkey=self.authkey)
+            manager.connect()
+            self.local.server = manager.asr()
+        return self.local.server
+
+    def transcribe(self, audio, **options):
+        return self._server().transcribe(audio, options)
+
+    def transcribe_batch(self, audios, **options):
+        return self._server().transcribe_many(audios, options)
+
+    def pending(self):
+        return self._server().pending()
+
+
+def serve(address, authkey, model_name='turbo', max_concurrency=1, max_batch=8, processes=1, threads_per_process=4):
+    """Run an ASR service process until it is killed."""
+    server = ASRServer(model_name, max_concurrency=max_concurrency, max_batch=max_batch,
+                       processes=processes, threads_per_process=threads_per_process)
+    ASRManager.register('asr', callable=lambda: server)
+    manager = ASRManager(address=address, authkey=authkey)
+    print(f"ASR service listening on {address[0]}:{address[1]}")
+    manager.get_server().serve_forever()
+
+
+def connect_or_start(address, authkey, model_name='turbo', max_concurrency=1, max_batch=8, processes=1, threads_per_process=4, timeout=600):
+    """Client of the ASR service at `address`, starting the service first if nobody is listening.
+
+    When several web workers race to start it, only one can bind the
+    address; the others simply connect to it.
+    """
+    client = ASRClient(address, authkey)
+    try:
+        client.pending()
+        return client
+    except (ConnectionRefusedError, FileNotFoundError):
+        pass
+
+    # A separate interpreter rather than multiprocessing, so the service
+    # doesn't re-import the web app and outlives the worker that started it
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.Popen([
+        sys.executable, '-m', 'libs.asr_service',
+        '--host', address[0], '--port', str(address[1]), '--model', model_name,
+        '--max_concurrency', str(max_concurrency), '--max_batch', str(max_batch),
+        '--processes', str(processes), '--threads_per_process', str(threads_per_process),
+    ], cwd=backend_dir, env=dict(os.environ, ASR_SERVICE_AUTHKEY=authkey.decode()), start_new_session=True)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            client.pending()
+            return client
+        except (ConnectionRefusedError, FileNotFoundError):
+            time.sleep(0.5)
+    raise TimeoutError(f"ASR service did not come up on {address[0]}:{address[1]}")
+
+
+def load_authkey(key_file):
+    """Authkey of the ASR service: ASR_SERVICE_AUTHKEY, else a random key kept in `key_file`.
+
+    The manager protocol unpickles what clients send, so whoever knows the
+    key can run code in the service. The key file is created on first use,
+    readable only by its owner; an existing one that others can read is
+    refused.
+    """
+    authkey = os.getenv('ASR_SERVICE_AUTHKEY')
+    if authkey:
+        return authkey.encode()
+    key_dir = os.path.dirname(os.path.abspath(key_file))
+    os.makedirs(key_dir, exist_ok=True)
+    if not os.path.exists(key_file):
+        # Written aside (mkstemp files are 0600) and linked into place, so racing workers agree on one key
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(tmp_path, key_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    if os.stat(key_file).st_mode & 0o077:
+        raise PermissionError(f"ASR service key file {key_file} is accessible by other users, chmod 600 it")
+    with open(key_file) as f:
+        return f.read().strip().encode()
+
+
+ASRManager.register('asr')
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the shared ASR service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('ASR_SERVICE_PORT', 50051)))
+    parser.add_argument('--model', default='turbo')
+    parser.add_argument('--max_concurrency', type=int, default=1, help='Number of batches transcribed at the same time')
+    parser.add_argument('--max_batch', type=int, default=8, help='Maximum number of jobs per batch')
+    parser.add_argument('--processes', type=int, default=1, help='Processes a batch is sharded over, each with its own model')
+    parser.add_argument('--threads_per_process', type=int, default=4, help='Torch threads of each process')
+    parser.add_argument('--key_file', default=os.getenv('ASR_SERVICE_KEY_FILE', './cache/asr_service.key'),
+                        help='Where the authkey is kept when ASR_SERVICE_AUTHKEY is not set')
+    args = parser.parse_args()
+    serve((args.host, args.port), load_authkey(args.key_file), args.model, args.max_concurrency, args.max_batch,
+          args.processes, args.threads_per_process)
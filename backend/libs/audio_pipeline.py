@@ -0,0 +1,271 @@
+import os
+import re
+import time
+import shutil
+import requests
+import subprocess
+import numpy as np
+from queue import Queue, Full
+from contextlib import nullcontext
+from threading import Thread, Event, Condition
+from libs.metrics import metrics
+
+SAMPLE_RATE = 16000  # Whisper expects 16 kHz mono audio
+
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable, falling back to the one bundled with moviepy."""
+    binary = os.getenv('FFMPEG_BINARY')
+    if binary:
+        return binary
+    if shutil.which('ffmpeg'):
+        return 'ffmpeg'
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def probe_duration(path):
+    """Duration of a media file in seconds, read from ffmpeg's stream info."""
+    result = subprocess.run([ffmpeg_binary(), '-nostdin', '-hide_banner', '-i', path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise RuntimeError(f"Could not read the duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data.extend(block)
+    return bytes(data)
+
+
+class Spool:
+    """Downloads a URL into a local file at network speed, for readers slower than the network.
+
+    The file is fetched in `range_size` byte HTTP range requests, like
+    pytube's own downloads; a dropped connection is resumed from the last
+    byte written, up to `retries` times in a row. `slot()`, e.g. a download
+    slot, is held only while downloading. `follow` reads the file as it
+    grows, so decoding can start before the download is done without
+    keeping the connection to the server waiting on it.
+    """
+    def __init__(self, url, path, slot=None, range_size=9 * 1024 * 1024, retries=5, timeout=30):
+        self.url = url
+        self.path = path
+        self.slot = slot
+        self.range_size = range_size
+        self.retries = retries
+        self.timeout = timeout
+        self.size = 0
+        self.total = None
+        self.error = None
+        self.finished = False
+        self.cancelled = False
+        self.changed = Condition()
+
+    def start(self):
+        open(self.path, 'wb').close()
+        Thread(target=metrics.in_context(self._run), daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            with self.slot() if self.slot is not None else nullcontext(), metrics.span('download'):
+                self._download()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.changed:
+                self.finished = True
+                self.changed.notify_all()
+
+    def _download(self):
+        failures = 0
+        with requests.Session() as session, open(self.path, 'ab') as f:
+            while not self.cancelled and (self.total is None or self.size < self.total):
+                try:
+                    headers = {'Range': f"bytes={self.size}-{self.size + self.range_size - 1}"}
+                    with session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as response:
+                        response.raise_for_status()
+                        if response.status_code == 206:
+                            self.total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                        elif self.size == 0:
+                            # No range support: the whole file in one response
+                            self.total = int(response.headers.get('Content-Length', 0)) or None
+                        else:
+                            raise RuntimeError("the server ignored the range request, can't resume")
+                        for block in response.iter_content(1024 * 1024):
+                            if self.cancelled:
+                                return
+                            f.write(block)
+                            f.flush()
+                            with self.changed:
+                                self.size += len(block)
+                                self.changed.notify_all()
+                    if response.status_code != 206 and self.total is None:
+                        return
+                    failures = 0
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                    failures += 1
+                    if failures > self.retries:
+                        raise
+                    print(f"Resuming download at byte {self.size} after: {e}")
+                    time.sleep(min(2 ** failures, 30))
+
+    def follow(self, block_size=64 * 1024):
+        """Yield the file's bytes as they are downloaded, raises if the download fails."""
+        with open(self.path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if block:
+                    yield block
+                    continue
+                with self.changed:
+                    self.changed.wait_for(lambda: self.finished or self.size > f.tell())
+                    if self.error is not None:
+                        raise self.error
+                    if self.finished and self.size <= f.tell():
+                        return
+
+    def wait(self):
+        """Block until the download is done, raises if it failed."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.finished)
+        if self.error is not None:
+            raise self.error
+        if self.cancelled:
+            raise RuntimeError("download cancelled")
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def _feed(spool, stdin):
+    try:
+        for block in spool.follow():
+            stdin.write(block)
+    except (BrokenPipeError, OSError):
+        pass  # ffmpeg exited, its own error is reported
+    except Exception:
+        pass  # the download failed, `spool.wait` raises its error
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def decode_audio_chunks(input_path, chunk_length_s, copy_to=None):
+    """Yield consecutive mono 16 kHz float32 chunks of `input_path` as ffmpeg decodes them.
+
+    `input_path` may be a local file, a stream URL or a `Spool` still being
+    downloaded, which ffmpeg reads through a pipe as it grows. A container
+    that can't be demuxed from a pipe is decoded from the spooled file
+    once it is complete. When `copy_to` is given the input is also remuxed
+    (without re-encoding) into that file in the same pass.
+    """
+    spool = input_path if isinstance(input_path, Spool) else None
+    if spool is None:
+        cmd = [ffmpeg_binary(), '-nostdin', '-loglevel', 'error', '-i', input_path]
+    else:
+        # Demuxing errors must fail the decode rather than end it early, see the fallback below
+        cmd = [ffmpeg_binary(), '-loglevel', 'error', '-xerror', '-i', 'pipe:0']
+    if copy_to is not None:
+        cmd += ['-map', '0:v?', '-map', '0:a?', '-c', 'copy', '-f', 'mp4', '-y', copy_to]
+    cmd += ['-map', '0:a:0', '-vn', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1']
+
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE if spool is not None else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if spool is not None:
+        Thread(target=_feed, args=(spool, process.stdin), daemon=True).start()
+    chunk_bytes = int(chunk_length_s * SAMPLE_RATE) * 2
+    decoded = False
+    try:
+        while True:
+            data = _read_exactly(process.stdout, chunk_bytes)
+            if not data:
+                break
+            decoded = True
+            yield np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+        process.stdout.close()
+        returncode = process.wait()
+        error = process.stderr.read().decode(errors='replace').strip()
+        if spool is not None and not decoded:
+            # E.g. an MP4 with its index at the end, which needs seeking
+            print(f"Decoding {spool.path} once downloaded, ffmpeg can't stream it: {error}")
+            spool.wait()
+            yield from decode_audio_chunks(spool.path, chunk_length_s, copy_to)
+            return
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {error}")
+        if spool is not None:
+            spool.wait()  # a truncated download must not pass for the whole audio
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def batches(iterable, size, first=None):
+    """Group consecutive items of `iterable` into lists of up to `size` items.
+
+    With `first`, the first batch has `first` items and every next one
+    twice as many, up to `size`, so the first results come sooner.
+    """
+    batch = []
+    limit = min(first or size, size)
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= limit:
+            yield batch
+            batch = []
+            limit = min(limit * 2, size)
+    if batch:
+        yield batch
+
+
+def prefetch(iterable, depth=1):
+    """Run `iterable` in a background thread, keeping up to `depth` items ready ahead of the consumer."""
+    queue = Queue(maxsize=depth)
+    stop = Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        put((done, None))
+
+    thread = Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,213 @@
+import os
+import re
+import shutil
+import bisect
+import tempfile
+import subprocess
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from libs.audio_pipeline import ffmpeg_binary
+
+KEYFRAME_TOLERANCE = 0.05  # seconds a cut may be off a keyframe and still be stream-copied
+MIN_CLIP_SECONDS = 0.5  # shorter spans make clips without a readable duration
+H264_PROFILES = {'66': 'baseline', '77': 'main', '100': 'high'}  # profile_idc -> x264 profile
+
+
+def is_remote(source):
+    return source.startswith(('http://', 'https://'))
+
+
+class ClipRenderer:
+    """Cuts clips out of a video, stream-copying whenever the GOP structure allows it.
+
+    A clip starting on a keyframe is copied as is. Otherwise only the
+    partial GOP up to the next keyframe is re-encoded and joined to a
+    stream copy of the rest. Clips are rendered in parallel, one ffmpeg
+    process each. Of a remote `source` (stream url), only the span of each
+    clip, from the keyframe before it, is fetched by stream copy with HTTP
+    range requests, and the clip is cut from that local copy the same way.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.keyframe_cache = {}
+        self.lock = Lock()
+
+    def keyframes(self, path):
+        """Sorted keyframe times of the first video stream of `path`."""
+        key = (os.path.abspath(path), os.path.getmtime(path))
+        with self.lock:
+            if key in self.keyframe_cache:
+                return self.keyframe_cache[key]
+        if shutil.which('ffprobe'):
+            result = subprocess.run([
+                'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+                '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', path,
+            ], capture_output=True, text=True)
+            times = [float(line.strip().rstrip(',')) for line in result.stdout.splitlines() if line.strip() not in ('', 'N/A')]
+        else:
+            result = subprocess.run([
+                ffmpeg_binary(), '-nostdin', '-hide_banner', '-skip_frame', 'nokey', '-i', path,
+                '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-',
+            ], capture_output=True, text=True)
+            times = [float(t) for t in re.findall(r"pts_time:\s*([0-9.]+)", result.stderr)]
+        times = sorted(times)
+        with self.lock:
+            self.keyframe_cache[key] = times
+        return times
+
+    def forget(self, path):
+        with self.lock:
+            for key in [key for key in self.keyframe_cache if key[0] == os.path.abspath(path)]:
+                del self.keyframe_cache[key]
+
+    def start_time(self, path):
+        """Timestamp of the first packet of `path`, in seconds."""
+        result = subprocess.run([ffmpeg_binary(), '-nostdin', '-hide_banner', '-i', path], capture_output=True, text=True)
+        match = re.search(r"start: (-?[0-9.]+)", result.stderr)
+        if match is None:
+            raise RuntimeError(f"no start time in {path}")
+        return float(match.group(1))
+
+    def video_codec(self, path):
+        result = subprocess.run([ffmpeg_binary(), '-nostdin', '-hide_banner', '-i', path], capture_output=True, text=True)
+        match = re.search(r"Video: (\w+)", result.stderr)
+        return match.group(1) if match else None
+
+    def h264_params(self, path):
+        """x264 settings that reproduce the first video stream's SPS, or None if it can't be matched.
+
+        The profile, level, chroma format, bit depth and reordering depth
+        come from the stream's SPS, the pixel format and timescale from the
+        container; a head encoded with them decodes with the same delay
+        (so DTS stay monotonic at the join) and the clip keeps the source's
+        profile.
+        """
+        result = subprocess.run([
+            ffmpeg_binary(), '-nostdin', '-hide_banner', '-i', path, '-map', '0:v:0', '-c', 'copy',
+            '-bsf:v', 'trace_headers', '-frames:v', '1', '-f', 'null', '-',
+        ], capture_output=True, text=True)
+        fields = dict(re.findall(r"\s(\w+)\s+[01]+ = (\d+)", result.stderr))
+        stream = re.search(r"Video: h264 .*?, (\w+)[(,].*?(\d+) tbn", result.stderr)
+        profile = H264_PROFILES.get(fields.get('profile_idc'))
+        # x264's reordering depth is 1 with B-frames and 2 with B-pyramids
+        bframes = {'0': ['-bf', '0'], '1': ['-bf', '1'], '2': ['-bf', '3']}.get(
+            fields.get('max_num_reorder_frames', '0' if profile == 'baseline' else None))
+        if (stream is None or profile is None or bframes is None or 'level_idc' not in fields
+                or fields.get('chroma_format_idc', '1') != '1' or fields.get('bit_depth_luma_minus8', '0') != '0'):
+            return None
+        # Unlike ultrafast, veryfast keeps the tools (CABAC, 8x8 transforms) the profile is named after
+        return ['-preset', 'veryfast', '-profile:v', profile, '-level', str(int(fields['level_idc']) / 10),
+                '-pix_fmt', stream.group(1), '-video_track_timescale', stream.group(2)] + bframes
+
+    def _run(self, args, loglevel='error'):
+        result = subprocess.run([ffmpeg_binary(), '-nostdin', '-loglevel', loglevel, '-y'] + args, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()}")
+        return result.stderr
+
+    def _copy(self, source, start, end, out_path, options=('-avoid_negative_ts', 'make_zero')):
+        self._run(['-ss', f"{start:.3f}", '-i', source, '-t', f"{end - start:.3f}",
+                   '-map', '0:v:0', '-map', '0:a?', '-c', 'copy', *options, out_path])
+
+    def _encode(self, source, start, end, out_path, threads, video_params=('-preset', 'ultrafast')):
+        self._run(['-ss', f"{start:.3f}", '-i', source, '-t', f"{end - start:.3f}",
+                   '-map', '0:v:0', '-map', '0:a?', '-c:v', 'libx264', *video_params,
+                   '-c:a', 'aac', '-threads', str(threads), out_path])
+
+    def render(self, source, start, end, out_path, threads=1):
+        """Render `source[start:end]` to `out_path`, returns how it was cut."""
+        if end - start < MIN_CLIP_SECONDS:
+            raise ValueError(f"Clip {start}-{end} is shorter than {MIN_CLIP_SECONDS}s")
+        if is_remote(source):
+            return self._render_remote(source, start, end, out_path, threads)
+        keyframes = self.keyframes(source)
+        index = bisect.bisect_left(keyframes, start - KEYFRAME_TOLERANCE)
+        next_keyframe = keyframes[index] if index < len(keyframes) else None
+        try:
+            if next_keyframe is not None and next_keyframe - start <= KEYFRAME_TOLERANCE:
+                self._copy(source, next_keyframe, end, out_path)
+                return 'copy'
+            # The re-encoded head is H.264, so it can only be joined to an H.264 tail it can match
+            if next_keyframe is not None and next_keyframe < end and self.video_codec(source) == 'h264':
+                video_params = self.h264_params(source)
+                if video_params is not None:
+                    self._smart_cut(source, start, next_keyframe, end, out_path, threads, video_params)
+                    return 'smart'
+        except RuntimeError as e:
+            print(f"Falling back to re-encoding clip {start}-{end}: {e}")
+        self._encode(source, start, end, out_path, threads)
+        return 'encode'
+
+    def _render_remote(self, source, start, end, out_path, threads):
+        """`render` of a stream url: cut the clip out of a local stream copy of its span.
+
+        Probing the keyframes of the remote file would read all of it, but
+        an input seek with stream copy starts at the keyframe before
+        `start`, fetching only the bytes from there to `end`. The copy
+        keeps the source's timestamps, so the span is found in it by its
+        start time.
+        """
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as tmp_dir:
+            span_path = os.path.join(tmp_dir, 'span.mp4')
+            try:
+                self._run(['-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', source,
+                           '-map', '0:v:0', '-map', '0:a?', '-c', 'copy', '-copyts', span_path])
+                offset = self.start_time(span_path)
+            except RuntimeError as e:
+                print(f"Falling back to re-encoding clip {start}-{end} from the stream: {e}")
+                self._encode(source, start, end, out_path, threads)
+                return 'encode'
+            try:
+                return self.render(span_path, start - offset, end - offset, out_path, threads)
+            finally:
+                self.forget(span_path)
+
+    def _smart_cut(self, source, start, keyframe, end, out_path, threads, video_params):
+        """Re-encode the partial GOP before `keyframe` like the source and join it to a stream copy of the rest.
+
+        Only the video is cut this way; the audio of the whole span is
+        encoded in one go while muxing, since AAC frames don't end on the
+        keyframe. The concat demuxer keeps only the head's SPS/PPS in the
+        sample description, so both parts also carry theirs in-band and the
+        copied tail isn't decoded with the head's. Any timestamp problem at
+        the join fails the cut, see `render`.
+        """
+        in_band = ['-bsf:v', 'h264_mp4toannexb', '-an']
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as tmp_dir:
+            head_path = os.path.join(tmp_dir, 'head.mp4')
+            tail_path = os.path.join(tmp_dir, 'tail.mp4')
+            list_path = os.path.join(tmp_dir, 'parts.txt')
+            self._encode(source, start, keyframe, head_path, threads, [*video_params, *in_band])
+            # Leading DTS stay negative, so the keyframe is the tail's time zero
+            self._copy(source, keyframe, end, tail_path, [*in_band, '-avoid_negative_ts', 'disabled'])
+            with open(list_path, 'w') as f:
+                # The tail starts exactly at the keyframe, whatever the head's container reports
+                f.write(f"file '{head_path}'\nduration {keyframe - start:.6f}\nfile '{tail_path}'\n")
+            log = self._run(['-f', 'concat', '-safe', '0', '-i', list_path,
+                             '-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', source,
+                             '-map', '0:v:0', '-map', '1:a?', '-c:v', 'copy', '-c:a', 'aac', out_path], loglevel='warning')
+            if re.search(r"non[ -]monoton", log, re.I):
+                raise RuntimeError(f"timestamps don't line up at the join: {log.strip()}")
+
+    @staticmethod
+    def clip_name(start, end):
+        return f"{start}_{end}.mp4"
+
+    def render_many(self, source, spans, out_dir):
+        """Render `(start, end)` spans of `source` in parallel, returns the clip paths in order."""
+        os.makedirs(out_dir, exist_ok=True)
+        if not spans:
+            return []
+        if not is_remote(source):
+            self.keyframes(source)
+        workers = max(1, min(self.max_workers, len(spans)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        out_paths = [os.path.join(out_dir, self.clip_name(start, end)) for start, end in spans]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.render, source, start, end, out_path, threads)
+                for (start, end), out_path in zip(spans, out_paths)
+            ]
+            for future in futures:
+                future.result()
+        return out_paths
@@ -0,0 +1,38 @@
+import asyncio
+from threading import Thread, Lock
+
+
+class EventLoop:
+    """One asyncio event loop running in a daemon thread.
+
+    Coroutines submitted from any thread run concurrently on that loop, so
+    thousands of requests waiting on the network share one thread instead
+    of holding one each. Nothing on the loop may block: blocking calls go
+    to threads (`asyncio.to_thread`, `JobManager.run_in_worker`).
+    """
+    def __init__(self, name='event-loop'):
+        self.name = name
+        self.lock = Lock()
+        self.loop = None
+
+    def start(self):
+        with self.lock:
+            if self.loop is not None:
+                return self.loop
+            self.loop = asyncio.new_event_loop()
+            Thread(target=self.loop.run_forever, name=self.name, daemon=True).start()
+            return self.loop
+
+    def submit(self, coro):
+        """Schedule `coro` on the loop, returns a `concurrent.futures.Future` of its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run(self, coro, timeout=None):
+        """Run `coro` on the loop and wait for its result, from a thread other than the loop's."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        with self.lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.loop = None
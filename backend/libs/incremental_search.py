@@ -0,0 +1,106 @@
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+from libs.prefilter import StreamingSelector
+from libs.transcript_format import StreamingWindows
+from libs.metrics import metrics
+from libs.search_content import scan_coverage
+
+
+class IncrementalSearch:
+    """Screens transcript windows with the LLM while the rest of the video is still being transcribed.
+
+    Words go in with `add` as ASR produces them. Every window that can no
+    longer change and passes the prefilter is screened right away, on up
+    to `max_concurrency` threads each holding `slot()` if given, and
+    `on_match(match)` is called for each window the LLM finds something
+    in. `finish` screens what is left once the transcript is complete and
+    returns the matches in time order, in the format of `_search_content`.
+    Once the `ScanBudget` `budget` is used up, no more windows are screened.
+    """
+    def __init__(self, chain, query, token_budget=1500, max_length=120, prefilter=None,
+                 max_concurrency=4, slot=None, on_match=None, budget=None):
+        prefilter = prefilter or {}
+        self.chain = chain
+        self.What = query['4w1h']['What']
+        self.windows = StreamingWindows(token_budget, max_length=max_length)
+        self.selector = StreamingSelector(
+            query['query'], query['4w1h'],
+            top_k=prefilter.get('top_k', 8),
+            threshold=prefilter.get('threshold', 0.0),
+            scan_all=prefilter.get('scan_all', False),
+        )
+        self.slot = slot
+        self.on_match = on_match
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self.lock = Lock()
+        self.packed = []  # every window so far, in time order
+        self.futures = {}  # window index -> screening future
+        self.screened = set()
+
+    def add(self, words, starts, ends, segments=None):
+        """Append newly transcribed words and start screening the windows they complete."""
+        with metrics.span('prefilter'):
+            self.windows.extend(words, starts, ends, segments)
+            self._offer(self.windows.ready())
+
+    @property
+    def streamed(self):
+        """Whether any words were added yet, even if they didn't complete a window."""
+        return bool(self.windows.words)
+
+    def _offer(self, windows):
+        for window in windows:
+            i = len(self.packed)
+            self.packed.append(window)
+            if self.selector.offer(i, window.plain_text):
+                self._submit(i)
+
+    def _submit(self, i):
+        if self.budget is not None and self.budget.stopped is not None:
+            return
+        self.futures[i] = self.executor.submit(metrics.in_context(self._screen), i)
+
+    def _screen(self, i):
+        window = self.packed[i]
+        if self.budget is not None and not self.budget.acquire():
+            return None
+        if self.slot is None:
+            search_result = self.chain.process(window.text, self.What)
+        else:
+            with self.slot():
+                search_result = self.chain.process(window.text, self.What)
+        self.screened.add(i)
+        if self.budget is not None:
+            self.budget.record(search_result)
+        if not search_result['success'] or 'None' in str(search_result['data']['start_time']):
+            return None
+        times = window.to_word_times(search_result['data']['start_time'], search_result['data']['end_time'])
+        if times is None:
+            return None
+        match = dict(search_result['data'], start_time=times[0], end_time=times[1])
+        if self.on_match is not None:
+            with self.lock:
+                self.on_match(match)
+        return match
+
+    def finish(self):
+        """Screen the windows left once the transcript is complete, returns all matches in time order."""
+        try:
+            with metrics.span('prefilter'):
+                self._offer(self.windows.ready(final=True))
+                for i in self.selector.finish():
+                    self._submit(i)
+            wait(self.futures.values())
+            print(f"Screened {len(self.screened)} of {len(self.packed)} transcript windows")
+            return [match for _, future in sorted(self.futures.items()) if (match := future.result()) is not None]
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def coverage(self):
+        """Which windows were screened, see `scan_coverage`."""
+        return scan_coverage(self.packed, self.screened, self.budget)
+
+    def cancel(self):
+        """Drop the windows still waiting to be screened, e.g. after the transcription failed."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,73 @@
+def merge_spans(spans, gap=0.0):
+    """Union of `(start, end)` spans, merging spans that overlap or are at most `gap` seconds apart.
+
+    A single sweep over the spans sorted by start; returns `[start, end]`
+    lists in time order.
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def relevance(hit):
+    """The 0-10 relevance the LLM gave a hit, or None if it gave none."""
+    try:
+        return float(hit.get('relevance'))
+    except (TypeError, ValueError):
+        return None
+
+
+def merge_hits(hits, gap=5.0):
+    """Merge content-search hits whose time ranges overlap or are at most `gap` seconds apart.
+
+    Overlapping transcript windows report the same moment more than once,
+    so hits are swept in start order and folded into the candidate they
+    reach. Each candidate keeps its float time range, the distinct
+    `content` of its hits in time order, the `info` and `relevance` of its
+    most relevant hit, and the number of hits merged into it. Hits whose
+    times aren't numbers are dropped.
+    """
+    spans = []
+    for hit in hits:
+        try:
+            start, end = float(hit['start_time']), float(hit['end_time'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        spans.append((min(start, end), max(start, end), hit))
+    spans.sort(key=lambda span: span[:2])
+
+    candidates = []
+    for start, end, hit in spans:
+        score = relevance(hit)
+        content = str(hit.get('content', '')).strip()
+        if candidates and start <= candidates[-1]['end_time'] + gap:
+            candidate = candidates[-1]
+            candidate['end_time'] = max(candidate['end_time'], end)
+            candidate['hits'] += 1
+            if content and content not in candidate['contents']:
+                candidate['contents'].append(content)
+            if score is not None and (candidate['relevance'] is None or score > candidate['relevance']):
+                candidate['relevance'] = score
+                candidate['info'] = hit.get('info', '')
+        else:
+            candidates.append({
+                'start_time': start,
+                'end_time': end,
+                'contents': [content] if content else [],
+                'info': hit.get('info', ''),
+                'relevance': score,
+                'hits': 1,
+            })
+
+    for candidate in candidates:
+        candidate['content'] = ' '.join(candidate.pop('contents'))
+    return candidates
+
+
+def rank_by_relevance(candidates):
+    """Candidates ordered most relevant first, earlier first among equals; the order used without the LLM."""
+    return sorted(candidates, key=lambda candidate: (-(candidate['relevance'] or 0), candidate['start_time']))
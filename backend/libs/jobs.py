@@ -0,0 +1,225 @@
+import time
+import uuid
+import asyncio
+import itertools
+from queue import PriorityQueue
+from threading import Thread, Lock, Condition
+from libs.metrics import metrics
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobManager:
+    """Bounded worker pool running background tasks from a priority queue.
+
+    Task records live in `tasks` (guarded by `lock`) so progress can be read
+    and updated while the job runs; whoever changes a record calls `touch`
+    so that `wait_for_change` listeners wake up. Jobs with a lower
+    `priority` run first; when `max_queued` jobs are already waiting,
+    `submit` raises `QueueFullError`. Records of finished tasks are evicted
+    `ttl` seconds after they finish, whether or not they were ever polled.
+
+    With an `EventLoop` as `loop`, `submit_async` runs coroutine jobs on it
+    instead: they don't take a worker while they wait on the network, up to
+    `max_in_flight` of them at once, and hand their blocking steps to the
+    workers with `run_in_worker`.
+    """
+    def __init__(self, num_workers=4, max_queued=32, ttl=600, loop=None, max_in_flight=1024):
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.loop = loop
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.tasks = {}
+        self.lock = Lock()
+        self.changed = Condition(self.lock)
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+        self.workers = []
+
+    def start(self):
+        with self.lock:
+            if self.workers:
+                return
+            for _ in range(self.num_workers):
+                worker = Thread(target=self._work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+            Thread(target=self._janitor, daemon=True).start()
+
+    def submit(self, target, record, priority=10):
+        """Queue `target(task_id)` and register its task `record`, returns the new task id."""
+        self.start()
+        self.evict_expired()
+        task_id = uuid.uuid4().hex
+        with self.lock:
+            if self.queue_full():
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+            self.tasks[task_id] = dict(record, status='queued', queued_at=time.time(), version=0)
+            self.queue.put((priority, next(self.counter), task_id, target))
+        return task_id
+
+    def submit_async(self, target, record):
+        """Run the coroutine `target(task_id)` on the event loop and register its task `record`, returns the new task id."""
+        if self.loop is None:
+            raise RuntimeError("JobManager has no event loop for coroutine jobs")
+        self.evict_expired()
+        task_id = uuid.uuid4().hex
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                raise QueueFullError(f"Too many requests in flight ({self.max_in_flight} running)")
+            self.in_flight += 1
+            self.tasks[task_id] = dict(record, status='queued', queued_at=time.time(), version=0)
+        self.loop.submit(self._run_async(task_id, target))
+        return task_id
+
+    async def run_in_worker(self, fn, priority=10):
+        """Await blocking `fn()` run by a worker thread, queued like a job of `priority`.
+
+        For the CPU- or disk-bound steps of coroutine jobs; `fn` counts
+        towards the job's trace (see `Metrics.in_context`).
+        Raises `QueueFullError` like `submit` when `max_queued` jobs are
+        already waiting.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fn = metrics.in_context(fn)
+
+        def settle(result=None, error=None):
+            if future.cancelled():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def target():
+            try:
+                result = fn()
+            except BaseException as e:
+                loop.call_soon_threadsafe(settle, None, e)
+            else:
+                loop.call_soon_threadsafe(settle, result)
+
+        with self.lock:
+            if self.queue_full():
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+            self.queue.put((priority, next(self.counter), None, target))
+        return await future
+
+    def touch(self, task_id):
+        """Mark a task record as changed, the caller holds `lock`."""
+        task = self.tasks.get(task_id)
+        if task is not None:
+            task['version'] = task.get('version', 0) + 1
+        self.changed.notify_all()
+
+    def wait_for_change(self, task_id, version=None, timeout=30):
+        """Snapshot of a task once its version differs from `version`, or after `timeout` seconds.
+
+        Returns None when the task doesn't exist (anymore).
+        """
+        def changed():
+            task = self.tasks.get(task_id)
+            return task is None or task.get('version') != version
+
+        with self.lock:
+            self.changed.wait_for(changed, timeout=timeout)
+            task = self.tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def queue_full(self):
+        return self.queue.qsize() >= self.max_queued
+
+    def queue_position(self, task_id):
+        with self.lock:
+            waiting = sorted(self.queue.queue)
+        for position, item in enumerate(waiting):
+            if item[2] == task_id:
+                return position
+        return None
+
+    def _work(self):
+        while True:
+            _, _, task_id, target = self.queue.get()
+            if task_id is None:
+                target()  # a blocking step of a coroutine job, see `run_in_worker`
+                continue
+            task = self._begin(task_id)
+            if task is None:
+                continue
+            with metrics.trace() as trace:
+                try:
+                    target(task_id)
+                except Exception as e:
+                    self._fail(task_id, e)
+            self._finish(task_id, trace)
+
+    async def _run_async(self, task_id, target):
+        try:
+            task = self._begin(task_id)
+            if task is None:
+                return
+            with metrics.trace() as trace:
+                try:
+                    await target(task_id)
+                except Exception as e:
+                    self._fail(task_id, e)
+            self._finish(task_id, trace)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _begin(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is not None and task['status'] == 'queued':
+                task['status'] = 'processing'
+                self.touch(task_id)
+        if task is not None:
+            metrics.observe('job_queue_wait_seconds', time.time() - task['queued_at'], help="Time jobs spent waiting in the queue")
+        return task
+
+    def _fail(self, task_id, e):
+        print(f"Error in job {task_id}: ", e)
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks[task_id].update({
+                    'status': 'error',
+                    'progress': 100,
+                    'message': f"Error in job: {str(e)}",
+                })
+
+    def _finish(self, task_id, trace):
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks[task_id]['finished_at'] = time.time()
+                self.tasks[task_id]['metrics'] = trace.summary()
+                self.touch(task_id)
+
+    def _janitor(self):
+        while True:
+            time.sleep(max(1, self.ttl / 4))
+            self.evict_expired()
+
+    def evict_expired(self):
+        """Drop finished tasks older than the TTL, and subtasks whose parent is gone."""
+        now = time.time()
+        with self.lock:
+            expired = [
+                task_id for task_id, task in self.tasks.items()
+                if now - task.get('finished_at', now) > self.ttl
+                or ('parent' in task and task['parent'] not in self.tasks)
+            ]
+            for task_id in expired:
+                self.tasks.pop(task_id, None)
+            if expired:
+                self.changed.notify_all()
+        return expired
@@ -0,0 +1,209 @@
+import os
+import glob
+import math
+import time
+import sqlite3
+import numpy as np
+from threading import Lock
+from collections import Counter
+from libs.prefilter import bm25_score, query_weights, tokenize
+from libs.transcript_format import split_phrases
+from libs.transcript_store import TranscriptStore, TRANSCRIPT_FILENAME
+
+
+class LibraryIndex:
+    """Inverted index over the transcripts of every video processed so far.
+
+    Transcripts are cut into passages of whole phrases of at most
+    `passage_seconds`; the index maps each term to the passages (video,
+    start, end) it occurs in, in a SQLite file that survives restarts and
+    artifact eviction. `search` ranks passages with BM25 without touching
+    the network, so moments from known videos are found in milliseconds.
+    """
+    def __init__(self, path, passage_seconds=30.0, k1=1.5, b=0.75):
+        self.path = path
+        self.passage_seconds = passage_seconds
+        self.k1 = k1
+        self.b = b
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS videos ("
+            "video_id TEXT PRIMARY KEY, url TEXT, title TEXT, duration REAL, indexed_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS passages ("
+            "id INTEGER PRIMARY KEY, video_id TEXT NOT NULL, start REAL NOT NULL, end REAL NOT NULL, "
+            "length INTEGER NOT NULL, text TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS passages_video ON passages (video_id)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, passage_id INTEGER NOT NULL, tf INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_term ON postings (term)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_passage ON postings (passage_id)")
+        self.conn.commit()
+
+    def has(self, video_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM videos WHERE video_id = ?", (video_id,)).fetchone() is not None
+
+    def passages(self, transcript):
+        """`(start, end, text)` of the passages a transcript is indexed as."""
+        words = transcript.words()
+        starts = np.asarray(transcript.starts)
+        ends = np.asarray(transcript.ends)
+        passages = []
+        lo = hi = None
+        for phrase_lo, phrase_hi in split_phrases(starts, ends, transcript.segments):
+            if lo is not None and ends[phrase_hi - 1] - starts[lo] > self.passage_seconds:
+                passages.append((float(starts[lo]), float(ends[hi - 1]), ''.join(words[lo:hi]).strip()))
+                lo = None
+            if lo is None:
+                lo = phrase_lo
+            hi = phrase_hi
+        if lo is not None:
+            passages.append((float(starts[lo]), float(ends[hi - 1]), ''.join(words[lo:hi]).strip()))
+        return passages
+
+    def add(self, video_id, transcript, url=None, title=None):
+        """Index (or re-index) a video's transcript."""
+        passages = self.passages(transcript)
+        with self.lock:
+            with self.conn:
+                self._remove(video_id)
+                self.conn.execute(
+                    "INSERT INTO videos (video_id, url, title, duration, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                    (video_id, url, title, transcript.duration, time.time()),
+                )
+                for start, end, text in passages:
+                    tf = Counter(tokenize(text))
+                    passage_id = self.conn.execute(
+                        "INSERT INTO passages (video_id, start, end, length, text) VALUES (?, ?, ?, ?, ?)",
+                        (video_id, round(start, 2), round(end, 2), sum(tf.values()), text),
+                    ).lastrowid
+                    self.conn.executemany(
+                        "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)",
+                        [(term, passage_id, freq) for term, freq in tf.items()],
+                    )
+        return len(passages)
+
+    def remove(self, video_id):
+        with self.lock:
+            with self.conn:
+                self._remove(video_id)
+
+    def _remove(self, video_id):
+        self.conn.execute(
+            "DELETE FROM postings WHERE passage_id IN (SELECT id FROM passages WHERE video_id = ?)", (video_id,)
+        )
+        self.conn.execute("DELETE FROM passages WHERE video_id = ?", (video_id,))
+        self.conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+
+    def search(self, query, four_w_one_h=None, limit=10, exclude=()):
+        """Best matching passages of all indexed videos, as moments with their video, times and score."""
+        weights = query_weights(query, four_w_one_h)
+        if not weights:
+            return []
+        terms = list(weights)
+        placeholders = ', '.join('?' * len(terms))
+        with self.lock:
+            num_passages, avg_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM passages").fetchone()
+            doc_freqs = dict(self.conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+            ).fetchall())
+            rows = self.conn.execute(
+                f"SELECT postings.passage_id, postings.term, postings.tf, passages.length "
+                f"FROM postings JOIN passages ON passages.id = postings.passage_id WHERE postings.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+        if not rows:
+            return []
+
+        idf = {
+            term: math.log(1 + (num_passages - doc_freqs.get(term, 0) + 0.5) / (doc_freqs.get(term, 0) + 0.5))
+            for term in terms
+        }
+        term_freqs, lengths = {}, {}
+        for passage_id, term, tf, length in rows:
+            term_freqs.setdefault(passage_id, {})[term] = tf
+            lengths[passage_id] = length
+        scores = {
+            passage_id: bm25_score(tf, lengths[passage_id], avg_length, idf, weights, self.k1, self.b)
+            for passage_id, tf in term_freqs.items()
+        }
+        best = sorted(scores, key=scores.get, reverse=True)
+
+        moments = []
+        with self.lock:
+            for passage_id in best:
+                if len(moments) >= limit:
+                    break
+                video_id, url, title, start, end, text = self.conn.execute(
+                    "SELECT passages.video_id, videos.url, videos.title, passages.start, passages.end, passages.text "
+                    "FROM passages JOIN videos ON videos.video_id = passages.video_id WHERE passages.id = ?",
+                    (passage_id,),
+                ).fetchone()
+                if video_id in exclude:
+                    continue
+                moments.append({
+                    'video_id': video_id,
+                    'url': url,
+                    'title': title,
+                    'start_time': start,
+                    'end_time': end,
+                    'content': text,
+                    'score': round(scores[passage_id], 3),
+                })
+        return moments
+
+    def stats(self):
+        with self.lock:
+            videos = self.conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+            passages = self.conn.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+            terms = self.conn.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+        return {'videos': videos, 'passages': passages, 'terms': terms}
+
+
+def index_downloads(index, download_dir='./downloads'):
+    """Add every transcript under `download_dir` that isn't indexed yet, returns the ids of the videos added.
+
+    Videos with only legacy `transcriptions/*.csv` are migrated to a
+    transcript store first (once, see `TranscriptStore.load`).
+    """
+    added = []
+    video_dirs = {os.path.dirname(path) for path in glob.glob(os.path.join(download_dir, '*', TRANSCRIPT_FILENAME))}
+    video_dirs.update(os.path.dirname(os.path.dirname(path))
+                      for path in glob.glob(os.path.join(download_dir, '*', 'transcriptions', '*.csv')))
+    for video_dir in sorted(video_dirs):
+        video_id = os.path.basename(video_dir)
+        if index.has(video_id):
+            continue
+        try:
+            transcript = TranscriptStore.load({
+                'transcript_path': os.path.join(video_dir, TRANSCRIPT_FILENAME),
+                'transcription_dir': os.path.join(video_dir, 'transcriptions'),
+            })
+        except (OSError, ValueError) as e:
+            print(f"Error loading the transcript of {video_id}: {e}")
+            continue
+        index.add(video_id, transcript, url=f"https://www.youtube.com/watch?v={video_id}")
+        added.append(video_id)
+    return added
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Index the stored transcripts, or search the index")
+    parser.add_argument('-d', '--download_dir', default='../downloads', help='Path to the downloads directory')
+    parser.add_argument('-i', '--index', default='../cache/library_index.sqlite', help='Path to the library index')
+    parser.add_argument('-q', '--query', default=None, help='Search the index instead of updating it')
+    args = parser.parse_args()
+    library = LibraryIndex(args.index)
+    if args.query:
+        for moment in library.search(args.query):
+            print(moment)
+    else:
+        print(f"Indexed {len(index_downloads(library, args.download_dir))} new videos: {library.stats()}")
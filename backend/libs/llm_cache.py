@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+from threading import Lock
+from langchain_core.runnables import RunnableSequence
+from libs.metrics import metrics, LLMUsageCallback
+
+
+class LLMCache:
+    """On-disk cache of parsed LLM responses with size-bounded LRU eviction.
+
+    Entries are stored in a SQLite file so the cache survives restarts and is
+    shared by every worker process using the same path. When the stored
+    values exceed `max_bytes`, the least recently used entries are dropped.
+    """
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class CachedChain:
+    """`prompt | llm | parser` chain whose parsed outputs are served from an `LLMCache`.
+
+    The cache key is a hash of the model settings, the fully rendered prompt
+    and the parser, so any change to one of them is a miss. Without a cache
+    it behaves exactly like the plain `RunnableSequence`. `ainvoke` is the
+    same for asyncio callers; its cache reads and writes, which commit to
+    disk, run in a thread.
+    """
+    def __init__(self, prompt, llm, parser, cache=None, name='llm'):
+        self.name = name
+        self.prompt = prompt
+        self.llm = llm
+        self.parser = parser
+        self.cache = cache
+        self.chain = RunnableSequence(prompt | llm | parser)
+
+    def cache_key(self, inputs):
+        try:
+            format_instructions = self.parser.get_format_instructions()
+        except NotImplementedError:
+            format_instructions = ''
+        key = json.dumps({
+            'model': getattr(self.llm, 'model_name', None) or getattr(self.llm, 'model', None),
+            'name': getattr(self.llm, 'name', None),
+            'temperature': getattr(self.llm, 'temperature', None),
+            'max_tokens': getattr(self.llm, 'max_tokens', None),
+            'prompt': self.prompt.format(**inputs),
+            'parser': type(self.parser).__name__ + format_instructions,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _invoke(self, inputs):
+        usage = LLMUsageCallback()
+        with metrics.span(self.name):
+            result = self.chain.invoke(inputs, config={'callbacks': [usage]})
+        metrics.record_llm(self.name, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        return result
+
+    def invoke(self, inputs):
+        if self.cache is None:
+            return self._invoke(inputs)
+        key = self.cache_key(inputs)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._invoke(inputs)
+            self.cache.set(key, result)
+        else:
+            metrics.record_llm(self.name, cached=True)
+        return result
+
+    async def _ainvoke(self, inputs):
+        usage = LLMUsageCallback()
+        with metrics.span(self.name):
+            result = await self.chain.ainvoke(inputs, config={'callbacks': [usage]})
+        metrics.record_llm(self.name, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        return result
+
+    async def ainvoke(self, inputs):
+        if self.cache is None:
+            return await self._ainvoke(inputs)
+        key = self.cache_key(inputs)
+        result = await asyncio.to_thread(self.cache.get, key)
+        if result is None:
+            result = await self._ainvoke(inputs)
+            await asyncio.to_thread(self.cache.set, key, result)
+        else:
+            metrics.record_llm(self.name, cached=True)
+        return result
@@ -0,0 +1,213 @@
+import time
+import contextvars
+from threading import Lock
+from functools import partial
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_active_traces = contextvars.ContextVar('active_traces', default=())
+
+
+class Trace:
+    """Stage timings and LLM usage of one task, for its result record.
+
+    Everything recorded while a trace is active (see `Metrics.trace`) is
+    added to it, including work handed to other threads through
+    `Metrics.in_context`. Traces nest: a subtask's spans also count towards
+    its parent's trace.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.llm = {}
+
+    def add_span(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+
+    def add_llm(self, chain, **counts):
+        with self.lock:
+            entry = self.llm.setdefault(chain, {'calls': 0, 'cached': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            for key, value in counts.items():
+                entry[key] += value
+
+    def summary(self):
+        with self.lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self.started, 3),
+                'stages': {stage: {'count': entry['count'], 'seconds': round(entry['seconds'], 3)} for stage, entry in self.stages.items()},
+                'llm': {chain: dict(entry) for chain, entry in self.llm.items()},
+            }
+
+
+class Metrics:
+    """Process-wide counters, duration histograms and gauges in the Prometheus text format.
+
+    Metric names are prefixed with `namespace`. Gauges are callables
+    evaluated when the metrics are rendered, e.g. the job queue depth.
+    """
+    def __init__(self, namespace='youclipai'):
+        self.namespace = namespace
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}"
+
+    def inc(self, name, value=1, help=None, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            if help:
+                self.help.setdefault(key[0], help)
+
+    def observe(self, name, seconds, help=None, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(DURATION_BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            if help:
+                self.help.setdefault(key[0], help)
+
+    def gauge(self, name, read, help=None, **labels):
+        """Register `read()` as the current value of a gauge."""
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = read
+            if help:
+                self.help.setdefault(key[0], help)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a pipeline stage, into the stage histogram and every active trace."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('stage_seconds', seconds, help="Duration of pipeline stages", stage=stage, **labels)
+            for trace in _active_traces.get():
+                trace.add_span(stage, seconds)
+
+    def iterate(self, stage, iterable):
+        """Iterate `iterable`, timing every wait for its next item as a `stage` span."""
+        iterator = iter(iterable)
+        while True:
+            with self.span(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @staticmethod
+    def in_context(fn):
+        """`fn` bound to a copy of the calling thread's context, for running it in another thread.
+
+        Context variables don't cross threads by themselves; spans and LLM
+        calls recorded by `fn` then still count towards the traces active
+        where it was handed off.
+        """
+        return partial(contextvars.copy_context().run, fn)
+
+    @contextmanager
+    def trace(self):
+        """Collect what the current task records into a new `Trace`."""
+        trace = Trace()
+        token = _active_traces.set(_active_traces.get() + (trace,))
+        try:
+            yield trace
+        finally:
+            _active_traces.reset(token)
+
+    def record_llm(self, chain, cached=False, prompt_tokens=0, completion_tokens=0):
+        self.inc('llm_calls_total', help="LLM chain invocations", chain=chain, cached=str(cached).lower())
+        if prompt_tokens or completion_tokens:
+            self.inc('llm_tokens_total', prompt_tokens, help="LLM tokens used", chain=chain, kind='prompt')
+            self.inc('llm_tokens_total', completion_tokens, help="LLM tokens used", chain=chain, kind='completion')
+        for trace in _active_traces.get():
+            trace.add_llm(chain, calls=1, cached=int(cached), prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def record_retry(self, chain):
+        self.inc('llm_retries_total', help="Failed LLM attempts, each followed by a retry while tries remain", chain=chain)
+        for trace in _active_traces.get():
+            trace.add_llm(chain, retries=1)
+
+    @staticmethod
+    def _labels(labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']} for key, h in self.histograms.items()}
+            gauges = dict(self.gauges)
+            helps = dict(self.help)
+
+        lines = []
+        seen = set()
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in helps:
+                    lines.append(f"# HELP {name} {helps[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            header(name, 'histogram')
+            for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+                lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, le='+Inf')} {histogram['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        for (name, labels), read in sorted(gauges.items(), key=lambda item: item[0]):
+            header(name, 'gauge')
+            try:
+                lines.append(f"{name}{self._labels(labels)} {read()}")
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """Collects the token usage reported by the chat model during one chain call."""
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                    prompt_tokens += usage_metadata.get('input_tokens', 0)
+                    completion_tokens += usage_metadata.get('output_tokens', 0)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+
+metrics = Metrics()
@@ -3,9 +3,10 @@ import requests
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
 from langchain_core.output_parsers import StrOutputParser
+from libs.llm_cache import CachedChain
+from libs.metrics import metrics
 
 overview_prompt = PromptTemplate(
     input_variables=["query"],
@@ -57,34 +58,60 @@ generate_search_query = PromptTemplate(
 )
 
 class OverviewTask:
-    def __init__(self, llm):
+    def __init__(self, llm, cache=None):
         self.llm = llm
-        self.chain = RunnableSequence(overview_prompt | llm | overview_output_parser)
-        self.generate_search_chain = RunnableSequence(generate_search_query | llm | StrOutputParser())
+        self.chain = CachedChain(overview_prompt, llm, overview_output_parser, cache, name='overview')
+        self.generate_search_chain = CachedChain(generate_search_query, llm, StrOutputParser(), cache, name='search_query')
 
     def process(self, query, num_tries=5):
         for _ in range(num_tries):
             try:
-                data = self._process(query)
-                return {
-                    'success': True,
-                    'data': data,
-                    'message': 'Successfully processed the query.',
-                }
+                return self._processed(self._process(query))
             except Exception as e:
-                print(e)
-        return {
-            'success': False,
-            'error': {
-                'type': 'ProcessingError',
-                'message': 'Failed to process the query.',
-            }
-        }
+                self._retry(e)
+        return self._failed()
     
     def _process(self, query):
         result = self.chain.invoke({"query": query})
         return result
     
     def generate_search_query(self, data):
-        result = self.generate_search_chain.invoke({"Who": data["Who"], "What": data["What"], "When": data["When"], "Where": data["Where"], "How": data["How"]})
+        result = self.generate_search_chain.invoke(self._search_query_inputs(data))
+        return result
+
+    async def aprocess(self, query, num_tries=5):
+        """`process` for asyncio callers, waiting on the LLM without holding a thread."""
+        for _ in range(num_tries):
+            try:
+                return self._processed(await self.chain.ainvoke({"query": query}))
+            except Exception as e:
+                self._retry(e)
+        return self._failed()
+
+    async def agenerate_search_query(self, data):
+        result = await self.generate_search_chain.ainvoke(self._search_query_inputs(data))
         return result
+
+    # Shared by the sync and async variants
+    def _processed(self, data):
+        return {
+            'success': True,
+            'data': data,
+            'message': 'Successfully processed the query.',
+        }
+
+    def _retry(self, e):
+        print(e)
+        metrics.record_retry('overview')
+
+    def _failed(self):
+        return {
+            'success': False,
+            'error': {
+                'type': 'ProcessingError',
+                'message': 'Failed to process the query.',
+            }
+        }
+
+    def _search_query_inputs(self, data):
+        return {"Who": data["Who"], "What": data["What"], "When": data["When"], "Where": data["Where"], "How": data["How"]}
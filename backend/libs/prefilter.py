@@ -0,0 +1,145 @@
+import re
+import math
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'clip', 'do', 'find', 'for', 'from', 'i', 'in',
+    'is', 'it', 'me', 'none', 'of', 'on', 'or', 'so', 'that', 'the', 'their', 'this', 'to', 'video',
+    'want', 'was', 'were', 'what', 'when', 'where', 'who', 'with', 'you',
+}
+# 4W1H fields weighted by how much they say about a moment's content
+FIELD_WEIGHTS = {'What': 2.0, 'Who': 1.0, 'How': 1.0, 'Where': 0.5, 'When': 0.5}
+
+
+def stem(token):
+    for suffix in ("'s", 'ing', 'ed', 'es', 's'):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+class BM25:
+    """Okapi BM25 over a small in-memory collection of documents."""
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freqs = Counter()
+        for tf in self.term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def scores(self, query_weights):
+        """Score every document against `{term: weight}`."""
+        return [
+            bm25_score(tf, length, self.avg_length, self.idf, query_weights, self.k1, self.b)
+            for tf, length in zip(self.term_freqs, self.lengths)
+        ]
+
+
+def bm25_score(tf, length, avg_length, idf, query_weights, k1=1.5, b=0.75):
+    """BM25 score of one document, given its term frequencies and the collection statistics."""
+    norm = k1 * (1 - b + b * length / avg_length) if avg_length else k1
+    score = 0.0
+    for term, weight in query_weights.items():
+        freq = tf.get(term, 0)
+        if freq:
+            score += weight * idf[term] * freq * (k1 + 1) / (freq + norm)
+    return score
+
+
+def query_weights(query, four_w_one_h=None):
+    """Weighted query terms from the raw query and its 4W1H fields."""
+    weights = Counter()
+    for term in tokenize(query):
+        weights[term] += 1.0
+    for field, value in (four_w_one_h or {}).items():
+        for term in tokenize(value):
+            weights[term] += FIELD_WEIGHTS.get(field, 1.0)
+    return weights
+
+
+def select_windows(window_texts, query, four_w_one_h=None, top_k=8, threshold=0.0, scan_all=False, by_score=False):
+    """Indices (in time order) of the transcript windows worth sending to the LLM.
+
+    Windows are ranked with BM25 against the query and its 4W1H fields; the
+    `top_k` best scoring above `threshold` are kept. Every window is kept
+    when `scan_all` is set, when there are no more than `top_k` windows, or
+    when no window shares any vocabulary with the query. With `by_score`
+    the indices come best scoring first instead, for scans that may stop
+    early.
+    """
+    indices = list(range(len(window_texts)))
+    if not by_score and (scan_all or (top_k is not None and len(window_texts) <= top_k)):
+        return indices
+    scores = BM25(window_texts).scores(query_weights(query, four_w_one_h))
+    ranked = sorted(indices, key=lambda i: scores[i], reverse=True)
+    if scan_all or (top_k is not None and len(window_texts) <= top_k):
+        return ranked if by_score else indices
+    candidates = [i for i in ranked if scores[i] > threshold]
+    if not candidates:
+        return ranked if by_score else indices
+    if top_k is not None:
+        candidates = candidates[:top_k]
+    return candidates if by_score else sorted(candidates)
+
+
+class StreamingSelector:
+    """`select_windows` for windows that arrive one at a time, e.g. while ASR is still running.
+
+    The final top-k can't be known before the last window, so a window is
+    selected when it scores above `threshold` and among the `top_k` best
+    scores offered so far (IDF over the windows seen so far). That screens
+    a few more windows than the offline selection, in exchange for
+    screening them as soon as they exist. `finish` returns what the offline
+    selection would add on top: every window when there are no more than
+    `top_k`, or when none shares vocabulary with the query.
+    """
+    def __init__(self, query, four_w_one_h=None, top_k=8, threshold=0.0, scan_all=False, k1=1.5, b=0.75):
+        self.weights = query_weights(query, four_w_one_h)
+        self.top_k = top_k
+        self.threshold = threshold
+        self.scan_all = scan_all
+        self.k1 = k1
+        self.b = b
+        self.doc_freqs = Counter()
+        self.num_documents = 0
+        self.total_length = 0
+        self.best_scores = []
+        self.selected = set()
+        self.offered = 0
+
+    def offer(self, index, text):
+        """Whether window `index` should be screened now."""
+        self.offered += 1
+        tf = Counter(tokenize(text))
+        self.doc_freqs.update(tf.keys())
+        self.num_documents += 1
+        self.total_length += sum(tf.values())
+        if self.scan_all:
+            self.selected.add(index)
+            return True
+        n = self.num_documents
+        idf = {term: math.log(1 + (n - self.doc_freqs[term] + 0.5) / (self.doc_freqs[term] + 0.5)) for term in self.weights}
+        score = bm25_score(tf, sum(tf.values()), self.total_length / n, idf, self.weights, self.k1, self.b)
+        if score <= self.threshold:
+            return False
+        if self.top_k is not None and len(self.best_scores) >= self.top_k and score <= self.best_scores[-1]:
+            return False
+        self.best_scores = sorted(self.best_scores + [score], reverse=True)[:self.top_k]
+        self.selected.add(index)
+        return True
+
+    def finish(self):
+        """Indices of windows not selected so far that should still be screened."""
+        if self.scan_all or self.selected and (self.top_k is None or self.offered > self.top_k):
+            return []
+        return [i for i in range(self.offered) if i not in self.selected]
@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+from threading import BoundedSemaphore
+
+
+class ResourcePools:
+    """Named pools of slots bounding how many jobs use a resource at once.
+
+    Each pipeline stage holds a slot of its pool while it runs, e.g.
+    `ResourcePools(download=2, asr=1, llm=8)` lets two videos download while
+    one is transcribed and up to eight LLM calls are in flight, regardless of
+    how many videos are being processed concurrently. Unknown pool names are
+    unbounded.
+    """
+    def __init__(self, **limits):
+        self.limits = dict(limits)
+        self.semaphores = {name: BoundedSemaphore(limit) for name, limit in limits.items()}
+
+    @contextmanager
+    def slot(self, name):
+        semaphore = self.semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def hold(self, name, iterable):
+        """Iterate `iterable` while holding a slot of `name` for its whole lifetime."""
+        with self.slot(name):
+            yield from iterable
@@ -1,17 +1,21 @@
 import os
 import sys
-import glob
-import numpy as np
+import time
+import random
 import argparse
-import pandas as pd
 sys.path.append("..")
 from libs.overview import OverviewTask
+from libs.transcript_store import TranscriptStore
+from libs.transcript_format import pack_windows
+from libs.llm_cache import CachedChain
+from libs.metrics import metrics
+from libs.intervals import merge_hits, merge_spans, rank_by_relevance, relevance
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from langchain_core.output_parsers import StrOutputParser
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 search_prompt = PromptTemplate(
     input_variables=["transcript", "start_time", "What"],
@@ -21,15 +25,16 @@ search_prompt = PromptTemplate(
         "1. Identify and extract the section that CONTAINS information related to the 'What' provided.\n"
         "2. If no relevant section is found, return 'None' for all fields.\n"
         "3. You MUST ensure that the extracted content is the LONGEST continuous section that covers the 'What' information.\n"
-        "Transcript [(word, start_time, end_time), ...]: {transcript}\n"
+        "Transcript (one phrase per line, each prefixed with its start time in seconds as [t]):\n{transcript}\n"
         "What (Information to extract): {What}\n"
         
         "You MUST return in the following format:\n"
         "{{\n"
         "  \"content\": \"The relevant section from the transcript or 'None' if no match.\",\n"
         "  \"info\": \"Explanation or context of the relevant section or 'None' if no match.\",\n"
-        "  \"start_time\": \"The start time of the relevant section or 'None' if no match.\",\n"
-        "  \"end_time\": \"The end time of the relevant section or 'None' if no match.\"\n"
+        "  \"start_time\": \"The [t] of the first phrase of the relevant section or 'None' if no match.\",\n"
+        "  \"end_time\": \"The [t] of the last phrase of the relevant section or 'None' if no match.\",\n"
+        "  \"relevance\": \"How well the section matches the 'What', from 0 (unrelated or no match) to 10 (exactly what is asked for).\"\n"
         "}}"
     ),
 )
@@ -39,52 +44,135 @@ response_schemas = [
     ResponseSchema(name="info", description="The extracted information based on the 'What' information in a 4W1H framework."),
     ResponseSchema(name="start_time", description="The start time of the extracted content."),
     ResponseSchema(name="end_time", description="The end time of the extracted content."),
+    ResponseSchema(name="relevance", description="How well the extracted content matches the 'What', from 0 to 10."),
 ]
 search_output_parser = StructuredOutputParser(response_schemas=response_schemas)
 
 ranking_prompt = PromptTemplate(
-    input_variables=["search_results", "query"],
+    input_variables=["candidates", "query"],
     template=(
-        "You are an AI assistant tasked with analyzing, merging, and ranking search results based on their relevance to a given query.\n\n"
+        "You are an AI assistant tasked with ranking sections of a video based on their relevance to a given query.\n\n"
         "Instructions:\n"
-        "1. Identify overlapping or closely related sections:\n"
-        "   - Two sections are considered overlapping if their time ranges intersect or if the end time of one section is within 5 seconds of the start time of another.\n"
-        "   - Two sections are considered closely related if their content discusses the same topic or has thematic similarity to the query.\n"
-        "   - Merge sections only if they meet both criteria: overlapping time ranges and thematic similarity.\n"
-        "2. Rank the merged sections based on their relevance to the query:\n"
-        "   - Prioritize sections that directly address the query.\n"
-        "   - Rank higher sections that are more specific, unique, and detailed in their relevance to the query.\n"
+        "1. Prioritize sections that directly address the query.\n"
+        "2. Rank higher sections that are more specific, unique, and detailed in their relevance to the query.\n"
         "3. The MOST relevant section should be at the start of the list.\n"
-        
-        "Search Results: {search_results}\n"
+
+        "Sections (one per line as [id] start-end seconds, relevance 0-10: info | content):\n{candidates}\n"
         "Query: {query}\n\n"
-        
-        "You MUST return the ranked results in the following format:\n"
+
+        "You MUST return the ids of all the sections, most relevant first, in the following format:\n"
         "{{\n"
-        "  \"ranked_results\": [\n"
-        "    {{\n"
-        "      \"start_time\": \"Earliest start time of the merged section, MUST be in float\",\n"
-        "      \"end_time\": \"Latest end time of the merged section, MUST be in float\"\n"
-        "    }},\n"
-        "    ...\n"
-        "  ]\n"
+        "  \"ranked_ids\": [id, id, ...]\n"
         "}}"
     ),
 )
 
 response_schemas = [
-    ResponseSchema(name="ranked_results", description="The ranked search results based on relevance to the query."),
+    ResponseSchema(name="ranked_ids", description="The ids of the sections, most relevant to the query first."),
 ]
 ranking_output_parser = StructuredOutputParser(response_schemas=response_schemas)
 
+def is_rate_limit_error(e):
+    """Check whether an exception comes from the LLM provider's rate limiter."""
+    if getattr(e, 'status_code', None) == 429:
+        return True
+    return type(e).__name__ == 'RateLimitError'
+
+def backoff_delay(e, attempt, base=1.0, max_delay=30.0):
+    """Seconds to wait before retrying, honouring a Retry-After header when present."""
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('retry-after')
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), max_delay)
+        except ValueError:
+            pass
+    return min(base * (2 ** attempt), max_delay) * (0.5 + random.random() / 2)
+
+class ScanBudget:
+    """When screening transcript windows may stop before every selected window was screened.
+
+    Screening stops once `max_hits` matches with a relevance of at least
+    `min_relevance` were found, after `max_calls` screened windows, or
+    `max_seconds` after the first window. Limits left as None don't apply;
+    `stopped` tells which one ended the scan.
+    """
+    def __init__(self, max_hits=None, min_relevance=8.0, max_calls=None, max_seconds=None):
+        self.max_hits = max_hits
+        self.min_relevance = min_relevance
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.lock = Lock()
+        self.calls = 0
+        self.hits = 0
+        self.started = None
+        self.stopped = None
+
+    @property
+    def limited(self):
+        return any(limit is not None for limit in (self.max_hits, self.max_calls, self.max_seconds))
+
+    def acquire(self):
+        """Whether one more window may be screened, counted as a call when it may."""
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            if self.stopped is None:
+                if self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds:
+                    self.stopped = 'max_seconds'
+                elif self.max_calls is not None and self.calls >= self.max_calls:
+                    self.stopped = 'max_calls'
+            if self.stopped is not None:
+                return False
+            self.calls += 1
+            return True
+
+    def record(self, search_result):
+        """Count a screened window towards `max_hits` if it is a confident match."""
+        if not search_result['success'] or 'None' in str(search_result['data']['start_time']):
+            return
+        score = relevance(search_result['data'])
+        with self.lock:
+            if score is not None and score >= self.min_relevance:
+                self.hits += 1
+                if self.max_hits is not None and self.hits >= self.max_hits and self.stopped is None:
+                    self.stopped = 'max_hits'
+
+def scan_coverage(windows, screened, budget=None):
+    """What a search looked at: time spans of the screened windows and of the rest, and why it stopped early if it did."""
+    def spans(indices):
+        return merge_spans((windows[i].start_time, windows[i].end_time) for i in indices)
+
+    screened_spans = spans(set(screened))
+    # Parts of the transcript no screened window covered; windows overlap, so this is
+    # less than the spans of the windows that weren't screened
+    not_screened = []
+    for start, end in spans(range(len(windows))):
+        for lo, hi in screened_spans:
+            if lo >= end or hi <= start:
+                continue
+            if lo > start:
+                not_screened.append([start, lo])
+            start = hi
+        if start < end:
+            not_screened.append([start, end])
+    return {
+        'windows': len(windows),
+        'screened_windows': len(set(screened)),
+        'screened': [[round(start, 2), round(end, 2)] for start, end in screened_spans],
+        'not_screened': [[round(start, 2), round(end, 2)] for start, end in not_screened],
+        'stopped': budget.stopped if budget is not None else None,
+    }
+
 class SearchContentTask:
-    def __init__(self, llm):
+    def __init__(self, llm, cache=None):
         self.llm = llm
-        self.chain = RunnableSequence(search_prompt | llm | search_output_parser)
-        self.ranking_chain = RunnableSequence(ranking_prompt | llm | ranking_output_parser)
+        self.chain = CachedChain(search_prompt, llm, search_output_parser, cache, name='screen')
+        self.ranking_chain = CachedChain(ranking_prompt, llm, ranking_output_parser, cache, name='rank')
 
     def process(self, transcript, What, num_tries=5):
-        for _ in range(num_tries):
+        for attempt in range(num_tries):
             try:
                 data = self._process(transcript, What)
                 return {
@@ -93,7 +181,9 @@ class SearchContentTask:
                     'message': 'Successfully processed the query.',
                 }
             except Exception as e:
-                pass
+                metrics.record_retry('screen')
+                if is_rate_limit_error(e):
+                    time.sleep(backoff_delay(e, attempt))
         return {
             'success': False,
             'error': {
@@ -105,42 +195,119 @@ class SearchContentTask:
     def _process(self, transcript, What):   
         result = self.chain.invoke({"transcript": transcript, "What": What})
         return result
+
+    def process_batch(self, transcripts, What, max_concurrency=4, on_result=None, num_tries=5, slot=None, budget=None):
+        """Screen several transcript windows concurrently.
+
+        At most `max_concurrency` requests are in flight at once; `slot`, when
+        given, is a context manager factory each request also holds (e.g. a
+        shared LLM pool). Results are returned in the same order as
+        `transcripts`; `on_result(index, result)` is called as each window
+        finishes. Windows are started in order, and once the `ScanBudget`
+        `budget` is used up the remaining ones are skipped with a None result.
+        A budget that stops after a number of hits screens in rounds of 1, 2,
+        4... windows, so a hit in the first windows saves the other calls.
+        """
+        results = [None] * len(transcripts)
+        if len(transcripts) == 0:
+            return results
+
+        def process(transcript):
+            if budget is not None and not budget.acquire():
+                return None
+            if slot is None:
+                result = self.process(transcript, What, num_tries)
+            else:
+                with slot():
+                    result = self.process(transcript, What, num_tries)
+            if budget is not None:
+                budget.record(result)
+            return result
+
+        ramp = budget is not None and budget.max_hits is not None
+        width = 1 if ramp else len(transcripts)
+        start = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(transcripts)))) as executor:
+            while start < len(transcripts) and (budget is None or budget.stopped is None):
+                futures = {
+                    executor.submit(metrics.in_context(process), transcripts[i]): i
+                    for i in range(start, min(start + width, len(transcripts)))
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    if on_result is not None:
+                        on_result(i, results[i])
+                start += width
+                width = min(width * 2, max(1, max_concurrency))
+        return results
     
-    def ranking(self, search_results, query, num_tries=5):
-        for _ in range(num_tries):
+    def ranking(self, search_results, query, num_tries=5, gap=5.0):
+        """Merge the hits of overlapping or nearby windows and rank the merged sections by relevance to `query`.
+
+        Hits at most `gap` seconds apart are merged locally (see
+        `merge_hits`); the LLM only orders the merged sections, and isn't
+        asked at all when there are fewer than two. Sections it leaves out,
+        or all of them when it can't be used, are ordered by the relevance
+        the screening step gave them.
+        """
+        candidates = merge_hits(search_results, gap=gap)
+        if len(candidates) < 2:
+            return {
+                'success': True,
+                'data': candidates,
+                'message': 'Successfully processed the query.',
+            }
+
+        lines = '\n'.join(
+            f"[{i}] {candidate['start_time']:g}-{candidate['end_time']:g}, {candidate['relevance'] if candidate['relevance'] is not None else '?'}: "
+            f"{candidate['info']} | {candidate['content'][:300]}"
+            for i, candidate in enumerate(candidates)
+        )
+        ranked_ids = []
+        for attempt in range(num_tries):
             try:
-                result = self.ranking_chain.invoke({"search_results": search_results, "query": query})
-                result = result['ranked_results']
-                return {
-                    'success': True,
-                    'data': result,
-                    'message': 'Successfully processed the query.',
-                }
+                ranked_ids = self.ranking_chain.invoke({"candidates": lines, "query": query})['ranked_ids']
+                break
             except Exception as e:
                 print(e)
-                pass    
+                metrics.record_retry('rank')
+                # Only rate limits are worth another try, the local order is as good as a reparse
+                if not is_rate_limit_error(e):
+                    break
+                time.sleep(backoff_delay(e, attempt))
+
+        ranked, seen = [], set()
+        for i in ranked_ids if isinstance(ranked_ids, list) else []:
+            try:
+                i = int(i)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= i < len(candidates) and i not in seen:
+                seen.add(i)
+                ranked.append(candidates[i])
+        ranked.extend(rank_by_relevance([candidate for i, candidate in enumerate(candidates) if i not in seen]))
         return {
-            'success': False,
-            'error': {
-                'type': 'ProcessingError',
-                'message': 'Failed to process the query.',
-            }
+            'success': True,
+            'data': ranked,
+            'message': 'Successfully processed the query.',
         }
-    
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input', default="../downloads/cNXxqE7hs9U/transcriptions", help='Path to the input transcript directory')
+    parser.add_argument('-i', '--input', default="../downloads/cNXxqE7hs9U/transcriptions", help='Path to the transcript store or a legacy transcript directory')
     parser.add_argument('-q', '--query', default="I want to find the clip of Austin Reaves commenting about posting working out in gym during Laker's media day 2024.", help='Query to search for in the transcripts')
     parser.add_argument('--chunk_length', type=int, default=120, help='Length of the audio chunks in seconds')
     parser.add_argument('--analysis_length', type=int, default=120, help='Length of the audio analysis in seconds')
+    parser.add_argument('--token_budget', type=int, default=1500, help='Maximum transcript tokens per analysis window')
     args = parser.parse_args()    
 
     load_dotenv()
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     global_llm = ChatOpenAI(name="gpt-4o-mini", temperature=0, max_tokens=256)
 
-    transcripts = sorted(glob.glob(f"{args.input}/*.csv"))
-    print(f"Found {len(transcripts)} transcripts")
+    transcript = TranscriptStore.load({'transcript_path': args.input, 'transcription_dir': args.input, 'chunk_length': args.chunk_length})
+    print(f"Found {len(transcript)} words over {transcript.duration:.1f}s")
 
 
     query = args.query
@@ -149,35 +316,15 @@ if __name__ == "__main__":
     search_chain = SearchContentTask(global_llm)
 
     if result['success']:
-        chunk_length = args.chunk_length
-        analysis_length = args.analysis_length
-        sliding_window = 0.5 * chunk_length
-        start_time = 0
         search_results = []
-        while start_time < len(transcripts) * chunk_length:
-            end_time = start_time + analysis_length - 1
-            print(f"Analyzing from {start_time} to {end_time}")
-            
-            start_chunk = transcripts[int(start_time / chunk_length)]
-            end_chunk = transcripts[min(int(end_time / chunk_length), len(transcripts) - 1)]
-
-            df = pd.read_csv(start_chunk)
-            if start_chunk != end_chunk:
-                next_df = pd.read_csv(end_chunk)
-                df = pd.concat([df, next_df], ignore_index=True)
-            
-            analyze_df = df[(df['start'] >= start_time) & (df['end'] <= end_time)]
-            content = analyze_df['word'].values.tolist()
-            content_start_time = analyze_df['start'].values.tolist()
-            content_end_time = analyze_df['end'].values.tolist()
-            formatted_content = ''
-            for i in range(len(content)):
-                formatted_content += '(' + content[i] + ',' + str(content_start_time[i]) + ',' + str(content_end_time[i]) + ")"
-  
-            search_result = search_chain.process(formatted_content, result['data']['What'])
+        for window in pack_windows(transcript, args.token_budget, max_length=args.analysis_length):
+            print(f"Analyzing from {window.start_time} to {window.end_time}")
+            search_result = search_chain.process(window.text, result['data']['What'])
             if search_result['success'] and 'None' not in str(search_result['data']['start_time']):
-                search_results.append(search_result['data'])
-            start_time += sliding_window
+                times = window.to_word_times(search_result['data']['start_time'], search_result['data']['end_time'])
+                if times is not None:
+                    search_result['data']['start_time'], search_result['data']['end_time'] = times
+                    search_results.append(search_result['data'])
         
         ranked_results = search_chain.ranking(search_results, query)
         if ranked_results['success']:
@@ -1,15 +1,19 @@
 import os
+import re
 import sys
 sys.path.append("..")
+import json
+import httpx
+import asyncio
 import requests
 import time
 from dotenv import load_dotenv
 from pytubefix import YouTube
 from libs.overview import OverviewTask
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from libs.llm_cache import CachedChain
+from libs.metrics import metrics
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
 from langchain_core.output_parsers import StrOutputParser
 from pytubefix import YouTube
@@ -44,17 +48,46 @@ response_schemas = [
     ResponseSchema(name="ranked_results", description="The ranked search results based on the user's query."),
 ]
 postprocess_parser = StructuredOutputParser(response_schemas=response_schemas)
+INITIAL_DATA_PATTERN = re.compile(r"ytInitialData\s*=\s*(\{.+?\})\s*;\s*(?:var\s|</script>)", re.S)
+
+
+def parse_duration(text):
+    """Seconds of a "1:02:03" / "12:34" length label, or None."""
+    try:
+        seconds = 0
+        for part in text.split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except (AttributeError, ValueError):
+        return None
+
+
+def video_renderers(data):
+    """Every `videoRenderer` of a results page's `ytInitialData`, in page order."""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if 'videoRenderer' in node:
+                yield node['videoRenderer']
+                continue
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
 
 
 class SearcYoutubeTask:
-    def __init__(self, llm):
+    def __init__(self, llm, cache=None, metadata_resolver=None):
         self.chrome_options = Options()
         self.chrome_options.add_argument("--headless")  # Ensure GUI is off
         self.chrome_options.add_argument("--disable-gpu") 
         self.chrome_options.add_argument("--window-size=1920x1080")  
 
         self.base_url = "https://www.youtube.com/"
-        self.postprocess_chain = RunnableSequence(postprocess_prompt | llm | postprocess_parser)
+        self.postprocess_chain = CachedChain(postprocess_prompt, llm, postprocess_parser, cache, name='postprocess')
+        self.metadata_resolver = metadata_resolver
+        self.http_client = None
+        self.http_loop = None
 
         self.duration_map = {
             'short': 'PT4M',     # Videos shorter than 4 minutes
@@ -74,34 +107,46 @@ class SearcYoutubeTask:
         search_box.send_keys(Keys.RETURN)
         time.sleep(2)
 
-        results = []
+        candidates = []
         videos = driver.find_elements(By.XPATH, '//ytd-video-renderer')[:max_results]
         for video in videos:
             try:
                 title_elem = video.find_element(By.XPATH, './/a[@id="video-title"]')
-                title = title_elem.text
-                url = title_elem.get_attribute("href")
-                
-                yt = YouTube(url)
-                video_id = yt.video_id
-                url = yt.watch_url
-                duration = yt.length
-
-                print(f"Title: {title}, URL: {url}, Duration: {duration}")
-
-                if duration > 1200 or duration < 60:
-                    continue
-
-                results.append({
-                    'id': video_id,
-                    'title': title,
-                    'url': url,
-                })
+                candidates.append((title_elem.text, title_elem.get_attribute("href")))
             except Exception as e:
                 print(f"Error processing video: {e}")
                 continue
-
         driver.quit()
+
+        # Resolve all candidates at once instead of one YouTube() per result
+        if self.metadata_resolver is not None:
+            metadatas = self.metadata_resolver.resolve_many([url for _, url in candidates])
+        else:
+            metadatas = []
+            for _, url in candidates:
+                try:
+                    yt = YouTube(url)
+                    metadatas.append({'id': yt.video_id, 'url': yt.watch_url, 'length': yt.length})
+                except Exception as e:
+                    print(f"Error processing video: {e}")
+                    metadatas.append(None)
+
+        results = []
+        for (title, _), metadata in zip(candidates, metadatas):
+            if metadata is None:
+                continue
+            duration = metadata['length']
+            print(f"Title: {title}, URL: {metadata['url']}, Duration: {duration}")
+
+            if duration > 1200 or duration < 60:
+                continue
+
+            results.append({
+                'id': metadata['id'],
+                'title': title,
+                'url': metadata['url'],
+            })
+
         return {
             'success': True,
             'data': results,
@@ -109,37 +154,112 @@ class SearcYoutubeTask:
         }
 
 
+    def _http_client(self):
+        # An AsyncClient's connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self.http_client is None or self.http_loop is not loop:
+            self.http_client = httpx.AsyncClient(
+                headers={'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-US,en;q=0.9'},
+                cookies={'CONSENT': 'YES+1'},
+                timeout=10,
+                follow_redirects=True,
+            )
+            self.http_loop = loop
+        return self.http_client
+
+    async def asearch(self, search_query, max_results=20):
+        """`search` for asyncio callers: one HTTP request for the results page instead of a browser.
+
+        The results page already carries every video's id, title and length,
+        so no per-video metadata is fetched. Falls back to the Selenium
+        `search`, in a thread, when the page can't be parsed.
+        """
+        try:
+            with metrics.span('youtube_search'):
+                response = await self._http_client().get(f"{self.base_url}results", params={'search_query': search_query})
+            response.raise_for_status()
+            match = INITIAL_DATA_PATTERN.search(response.text)
+            if not match:
+                raise ValueError("initial data not found")
+            renderers = list(video_renderers(json.loads(match.group(1))))[:max_results]
+        except Exception as e:
+            print(f"Falling back to the Selenium search for {search_query!r}: {e}")
+            return await asyncio.to_thread(self.search, search_query, max_results)
+
+        results = []
+        for renderer in renderers:
+            try:
+                video_id = renderer['videoId']
+                title = ''.join(run['text'] for run in renderer['title']['runs'])
+            except (KeyError, TypeError) as e:
+                print(f"Error processing video: {e}")
+                continue
+            duration = parse_duration(renderer.get('lengthText', {}).get('simpleText'))
+            url = f"https://www.youtube.com/watch?v={video_id}"
+            print(f"Title: {title}, URL: {url}, Duration: {duration}")
+            # Live streams have no length
+            if duration is None or duration > 1200 or duration < 60:
+                continue
+            results.append({
+                'id': video_id,
+                'title': title,
+                'url': url,
+            })
+
+        return {
+            'success': True,
+            'data': results,
+            'message': 'Successfully fetched the search results.',
+        }
+
     def download_video(self, video, out_dir='./downloads', verbose=False, audio=True):
         video_id = video['id']
         video_title = video['title']
         if verbose:
             print(f"Downloading video: {video_title} ...")
         yt = YouTube(f'https://www.youtube.com/watch?v={video_id}')
-        stream = yt.streams.first()
-        video_out_path = stream.download(out_dir)
 
         if audio:
+            # Download only the smallest audio stream rather than extracting it from the full video
             audio_out_dir = os.path.join(out_dir, 'audio')
             os.makedirs(audio_out_dir, exist_ok=True)
-            audio_out_path = os.path.join(audio_out_dir, f'{video_title}.wav')
-            video = VideoFileClip(video_out_path)
-            audio = video.audio
-            audio.write_audiofile(audio_out_path)
-            video.close()
-            audio.close()
+            stream = yt.streams.filter(only_audio=True).order_by('abr').first()
+            stream.download(audio_out_dir, filename=f'{video_title}.{stream.subtype}')
+        else:
+            stream = yt.streams.first()
+            stream.download(out_dir)
         return 
     
     def postprocess(self, results, query, num_tries=5):
         search_results = results['data']
         for _ in range(num_tries):
             try: 
-                results = self.postprocess_chain.invoke({"search_results": search_results, "query": query})
-                return {
-                    'success': True,
-                    'data': results['ranked_results'],
-                }
+                return self._postprocessed(self.postprocess_chain.invoke({"search_results": search_results, "query": query}))
+            except Exception as e:
+                self._postprocess_retry(e)
+        return self._postprocess_failed()
+
+    async def apostprocess(self, results, query, num_tries=5):
+        search_results = results['data']
+        for _ in range(num_tries):
+            try:
+                return self._postprocessed(await self.postprocess_chain.ainvoke({"search_results": search_results, "query": query}))
             except Exception as e:
-                print(f"Error processing search results: {e}")
+                self._postprocess_retry(e)
+        return self._postprocess_failed()
+
+    # Shared by postprocess and apostprocess
+    def _postprocessed(self, results):
+        return {
+            'success': True,
+            'data': results['ranked_results'],
+        }
+
+    def _postprocess_retry(self, e):
+        print(f"Error processing search results: {e}")
+        metrics.record_retry('postprocess')
+
+    def _postprocess_failed(self):
         return {
             'success': False,
             'error': {
@@ -0,0 +1,68 @@
+from threading import Event, Lock
+from libs.metrics import metrics
+
+
+class Flight:
+    """One in-flight call of a `SingleFlight`, with the callers waiting for it."""
+    def __init__(self, leader):
+        self.lock = Lock()
+        self.done = Event()
+        self.callers = [leader]
+        self.result = None
+        self.error = None
+
+    def join(self, caller):
+        with self.lock:
+            self.callers.append(caller)
+
+    def members(self):
+        """Everyone waiting for this call so far, the leader first."""
+        with self.lock:
+            return list(self.callers)
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time within this process.
+
+    The first caller for a key runs `fn(flight)`; callers arriving while it
+    runs wait for it and get its result (or its exception) instead of
+    doing the same work again. `flight.members()` tells the running call
+    whom to report progress to. `name` labels the metrics.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = Lock()
+        self.flights = {}
+
+    def run(self, key, fn, caller=None):
+        """`fn(flight)`'s result, and whether it was shared with an earlier caller's call."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(caller)
+                leader = True
+            else:
+                flight.join(caller)
+                leader = False
+
+        if not leader:
+            metrics.inc('single_flight_shared_total', help="Calls that waited for identical in-flight work instead of repeating it", work=self.name)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn(flight)
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.flights)
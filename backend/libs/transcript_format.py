@@ -0,0 +1,156 @@
+import bisect
+import numpy as np
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('o200k_base')
+except Exception:
+    _encoding = None
+
+MAX_PHRASE_WORDS = 20
+MAX_PHRASE_GAP = 1.0  # seconds of silence that end a phrase
+
+
+def count_tokens(text):
+    """Number of LLM tokens in `text`, estimated from its length when tiktoken is unavailable."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def split_phrases(starts, ends, segments=None, lo=0, hi=None):
+    """Split words `lo:hi` into phrases at Whisper segment boundaries, pauses and a maximum length."""
+    hi = len(starts) if hi is None else hi
+    phrases = []
+    phrase_lo = lo
+    for i in range(lo + 1, hi):
+        if (
+            i - phrase_lo >= MAX_PHRASE_WORDS
+            or starts[i] - ends[i - 1] > MAX_PHRASE_GAP
+            or (segments is not None and segments[i] != segments[i - 1])
+        ):
+            phrases.append((phrase_lo, i))
+            phrase_lo = i
+    if hi > lo:
+        phrases.append((phrase_lo, hi))
+    return phrases
+
+
+class CompactWindow:
+    """A transcript window encoded with one relative timestamp per phrase.
+
+    Each line reads `[t] phrase`, where `t` is the phrase start in seconds
+    from `offset`. Times given back by the LLM in that scale are mapped onto
+    exact word-level times with `to_word_times`.
+    """
+    def __init__(self, words, starts, ends, phrases):
+        self.starts = starts
+        self.ends = ends
+        self.phrases = phrases
+        self.offset = float(starts[phrases[0][0]]) if phrases else 0.0
+        self.start_time = self.offset
+        self.end_time = float(ends[phrases[-1][1] - 1]) if phrases else 0.0
+        self.markers = [round(float(starts[lo]) - self.offset, 1) for lo, _ in phrases]
+        self.lines = [
+            f"[{marker:g}]{''.join(words[lo:hi])}" for marker, (lo, hi) in zip(self.markers, phrases)
+        ]
+        self.text = '\n'.join(self.lines)
+        self.plain_text = ''.join(words[phrases[0][0]:phrases[-1][1]]) if phrases else ''
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def to_word_times(self, start, end):
+        """Absolute (start, end) of the phrases the LLM pointed at, or None if unparseable."""
+        try:
+            start, end = float(start), float(end)
+        except (TypeError, ValueError):
+            return None
+        if not self.phrases:
+            return None
+        first = max(0, bisect.bisect_right(self.markers, start + 0.05) - 1)
+        last = max(first, bisect.bisect_right(self.markers, end + 0.05) - 1)
+        return (
+            round(float(self.starts[self.phrases[first][0]]), 2),
+            round(float(self.ends[self.phrases[last][1] - 1]), 2),
+        )
+
+
+class StreamingWindows:
+    """`pack_windows` for a transcript that is still being transcribed.
+
+    Words are appended with `extend`; `ready` returns the windows that
+    can no longer change, i.e. exactly the windows `pack_windows` would
+    produce for the final transcript, as soon as the words covering them
+    (and the phrase after them) are known. `ready(final=True)` flushes the
+    rest once the transcript is complete.
+    """
+    def __init__(self, token_budget=1500, max_length=120, overlap=0.5):
+        self.token_budget = token_budget
+        self.max_length = max_length
+        self.overlap = overlap
+        self.words, self.starts, self.ends, self.segments = [], [], [], []
+        self.costs = []  # token cost of each complete phrase
+        self.first = 0  # first phrase of the next window
+        self.done = False
+
+    def extend(self, words, starts, ends, segments=None):
+        self.words.extend(words)
+        self.starts.extend(np.asarray(starts, dtype=np.float64).tolist())
+        self.ends.extend(np.asarray(ends, dtype=np.float64).tolist())
+        if segments is None or self.segments is None:
+            self.segments = None
+        else:
+            self.segments.extend(np.asarray(segments).tolist())
+
+    def ready(self, final=False):
+        """Windows completed since the last call, in time order."""
+        starts = np.asarray(self.starts)
+        ends = np.asarray(self.ends)
+        # Every phrase but the last is complete: later words can only extend the last one
+        phrases = split_phrases(starts, ends, self.segments)
+        complete = len(phrases) if final else len(phrases) - 1
+
+        def cost(i):
+            # Phrase cost: its words, a short marker and the line break
+            while len(self.costs) < complete:
+                lo, hi = phrases[len(self.costs)]
+                self.costs.append(count_tokens(''.join(self.words[lo:hi])) + 4)
+            if i < len(self.costs):
+                return self.costs[i]
+            lo, hi = phrases[i]
+            return count_tokens(''.join(self.words[lo:hi])) + 4
+
+        windows = []
+        while not self.done and self.first < len(phrases):
+            first = last = self.first
+            tokens = cost(first)
+            while (
+                last + 1 < len(phrases)
+                and tokens + cost(last + 1) <= self.token_budget
+                and ends[phrases[last + 1][1] - 1] - starts[phrases[first][0]] <= self.max_length
+            ):
+                last += 1
+                tokens += cost(last)
+            # A window that ran out of phrases could still grow; one that was closed by a
+            # phrase that didn't fit is final, since phrases only get longer
+            if not final and last + 1 >= len(phrases):
+                break
+            windows.append(CompactWindow(self.words, starts, ends, phrases[first:last + 1]))
+            if last + 1 >= len(phrases):
+                self.done = True
+                break
+            self.first = max(first + 1, first + int((last - first + 1) * (1 - self.overlap)))
+        return windows
+
+
+def pack_windows(transcript, token_budget=1500, max_length=120, overlap=0.5):
+    """Cover the transcript with windows of whole phrases, each within `token_budget` tokens.
+
+    A window grows phrase by phrase until it would exceed the token budget
+    or span more than `max_length` seconds; the next window starts at the
+    phrase `overlap` of the way through the previous one.
+    """
+    windows = StreamingWindows(token_budget, max_length=max_length, overlap=overlap)
+    windows.extend(transcript.words(), transcript.starts, transcript.ends, transcript.segments)
+    return windows.ready(final=True)
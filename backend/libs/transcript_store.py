@@ -0,0 +1,207 @@
+import os
+import json
+import glob
+import numpy as np
+import pandas as pd
+from libs.artifact_store import temp_path
+
+MAGIC = b'YCTS0001'
+ALIGNMENT = 8
+TRANSCRIPT_FILENAME = 'transcript.bin'
+
+
+class TranscriptWindow:
+    """Words of a transcript between two points in time.
+
+    `starts` and `ends` are zero-copy views into the memory-mapped store, the
+    words themselves are only decoded when `words` is accessed.
+    """
+    def __init__(self, store, lo, hi):
+        self.store = store
+        self.lo = lo
+        self.hi = hi
+        self.starts = store.starts[lo:hi]
+        self.ends = store.ends[lo:hi]
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    @property
+    def words(self):
+        return self.store.words(self.lo, self.hi)
+
+    @property
+    def text(self):
+        return ''.join(self.words).strip()
+
+
+class TranscriptStore:
+    """Per-video transcript stored as contiguous typed arrays in one file.
+
+    Layout: an 8 byte magic, a little-endian uint64 header length, a JSON
+    header describing each array (offset, dtype, length) and free-form
+    metadata, then the arrays themselves aligned to 8 bytes:
+
+    - `start`, `end`: float64 word times in seconds, sorted by start
+    - `end_max`: running maximum of `end`, used as the time index for the
+      end bound of a window lookup
+    - `word_offsets`: int64 byte offsets into `word_bytes`, one more than
+      the number of words
+    - `word_bytes`: the UTF-8 encoded words, concatenated
+    - `segment` (optional): index of the Whisper segment each word came from
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a transcript store: {path}")
+            header_length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        self.meta = header.get('meta', {})
+        self.arrays = {}
+        for name, (offset, dtype, length) in header['arrays'].items():
+            if length == 0:
+                self.arrays[name] = np.empty(0, dtype=dtype)
+            else:
+                self.arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,))
+        self.starts = self.arrays['start']
+        self.ends = self.arrays['end']
+        self.end_max = self.arrays['end_max']
+        self.word_offsets = self.arrays['word_offsets']
+        self.word_bytes = self.arrays['word_bytes']
+        self.segments = self.arrays.get('segment')
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def duration(self):
+        if 'duration' in self.meta:
+            return float(self.meta['duration'])
+        return float(self.end_max[-1]) if len(self) else 0.0
+
+    def words(self, lo=0, hi=None):
+        hi = len(self) if hi is None else hi
+        offsets = self.word_offsets[lo:hi + 1]
+        data = self.word_bytes[offsets[0]:offsets[-1]].tobytes() if hi > lo else b''
+        base = int(offsets[0]) if hi > lo else 0
+        return [data[int(a) - base:int(b) - base].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def window(self, start_time, end_time):
+        """Words that start at or after `start_time` and end at or before `end_time`."""
+        lo = int(np.searchsorted(self.starts, start_time, side='left'))
+        hi = int(np.searchsorted(self.end_max, end_time, side='right'))
+        return TranscriptWindow(self, lo, max(lo, hi))
+
+    @staticmethod
+    def write(path, words, starts, ends, meta=None, extra_arrays=None):
+        """Write a transcript store atomically to `path`."""
+        starts = np.asarray(starts, dtype='<f8')
+        ends = np.asarray(ends, dtype='<f8')
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        ends = ends[order]
+        encoded = [words[i].encode('utf-8') for i in order]
+        word_offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+        if encoded:
+            word_offsets[1:] = np.cumsum([len(w) for w in encoded])
+        arrays = {
+            'start': starts,
+            'end': ends,
+            'end_max': np.maximum.accumulate(ends) if len(ends) else ends,
+            'word_offsets': word_offsets,
+            'word_bytes': np.frombuffer(b''.join(encoded), dtype='u1'),
+        }
+        for name, values in (extra_arrays or {}).items():
+            arrays[name] = np.asarray(values)[order]
+
+        # The header size depends on the offsets it contains, so lay the
+        # arrays out after a generously sized header and pad it
+        header = {'meta': meta or {}, 'arrays': {}}
+        header_length = len(json.dumps(header).encode('utf-8')) + 96 * len(arrays)
+        offset = _align(len(MAGIC) + 8 + header_length)
+        for name, values in arrays.items():
+            header['arrays'][name] = [offset, values.dtype.str, int(len(values))]
+            offset = _align(offset + values.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8').ljust(header_length)
+
+        tmp_path = temp_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.array([header_length], dtype='<u8').tobytes())
+            f.write(header_bytes)
+            for name, values in arrays.items():
+                f.seek(header['arrays'][name][0])
+                f.write(values.tobytes())
+            f.truncate(offset)
+        os.replace(tmp_path, path)
+        return TranscriptStore(path)
+
+    @classmethod
+    def from_csv_dir(cls, transcription_dir, path=None, chunk_length=120):
+        """Migrate a legacy `transcriptions/*.csv` directory into a store."""
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.normpath(transcription_dir)), TRANSCRIPT_FILENAME)
+        csvs = sorted(glob.glob(os.path.join(transcription_dir, '*.csv')))
+        frames = [pd.read_csv(csv, keep_default_na=False) for csv in csvs]
+        frames = [df for df in frames if len(df) > 0]
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = pd.DataFrame({'word': [], 'start': [], 'end': []})
+        return cls.write(
+            path,
+            df['word'].astype(str).tolist(),
+            df['start'].values,
+            df['end'].values,
+            meta={'duration': len(csvs) * chunk_length, 'chunk_length': chunk_length},
+        )
+
+    @classmethod
+    def load(cls, metadata):
+        """Open the store described by an `_analyze_asr` result, migrating legacy CSVs if needed.
+
+        A migrated store's path is written back into `metadata`, and a store
+        found next to the CSV directory is opened as is, so the CSVs are
+        only ever parsed once.
+        """
+        path = metadata.get('transcript_path', '')
+        if path and os.path.exists(path):
+            return cls(path)
+        transcription_dir = metadata.get('transcription_dir', '')
+        if transcription_dir and os.path.isdir(transcription_dir):
+            if not path:
+                path = os.path.join(os.path.dirname(os.path.normpath(transcription_dir)), TRANSCRIPT_FILENAME)
+            if os.path.exists(path):
+                store = cls(path)
+            else:
+                store = cls.from_csv_dir(transcription_dir, path, chunk_length=metadata.get('chunk_length', 120))
+            metadata['transcript_path'] = store.path
+            return store
+        raise FileNotFoundError(f"No transcript found for {path or transcription_dir}")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def migrate_downloads(download_dir='./downloads', chunk_length=120):
+    """Convert every legacy per-chunk CSV transcript under `download_dir`."""
+    migrated = []
+    for transcription_dir in sorted(glob.glob(os.path.join(download_dir, '*', 'transcriptions'))):
+        path = os.path.join(os.path.dirname(transcription_dir), TRANSCRIPT_FILENAME)
+        if os.path.exists(path):
+            continue
+        TranscriptStore.from_csv_dir(transcription_dir, path, chunk_length=chunk_length)
+        migrated.append(path)
+        print(f"Migrated {transcription_dir} -> {path}")
+    return migrated
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Migrate per-chunk CSV transcripts into transcript stores")
+    parser.add_argument('-d', '--download_dir', default='../downloads', help='Path to the downloads directory')
+    parser.add_argument('--chunk_length', type=int, default=120, help='Length of the audio chunks in seconds')
+    args = parser.parse_args()
+    migrate_downloads(args.download_dir, args.chunk_length)
@@ -0,0 +1,168 @@
+import numpy as np
+from libs.audio_pipeline import SAMPLE_RATE
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+FRAME_SECONDS = 0.03  # webrtcvad accepts 10, 20 or 30 ms frames
+FRAME_SAMPLES = int(FRAME_SECONDS * SAMPLE_RATE)
+
+
+class EnergyDetector:
+    """Marks frames as speech when they are `margin_db` louder than the recent noise floor.
+
+    The noise floor is a low percentile of the frame energies of the last
+    `history_s` seconds, so the threshold follows the loudness of the
+    recording. Frames quieter than `min_db` are never speech.
+    """
+    def __init__(self, margin_db=12.0, min_db=-50.0, history_s=30.0):
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.history = np.zeros(0, dtype=np.float32)
+        self.history_frames = int(history_s / FRAME_SECONDS)
+
+    def __call__(self, frames):
+        energy = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        self.history = np.concatenate([self.history, energy])[-self.history_frames:]
+        threshold = max(self.min_db, float(np.percentile(self.history, 10)) + self.margin_db)
+        return energy > threshold
+
+
+class WebRTCDetector:
+    """Speech frames according to WebRTC's voice activity detector, which also rejects most music and noise."""
+    def __init__(self, aggressiveness=2):
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def __call__(self, frames):
+        pcm = (np.clip(frames, -1, 1) * 32767).astype('<i2')
+        return np.array([self.vad.is_speech(frame.tobytes(), SAMPLE_RATE) for frame in pcm])
+
+
+class MinimumSpeechGuard:
+    """Wraps a detector so a block it keeps less than `min_share` of is transcribed whole.
+
+    A detector that misjudges a recording, e.g. the energy detector on
+    speech over steady background noise, would otherwise drop its speech
+    without a trace. Blocks quieter than `silence_db` overall are left to
+    the detector, there is nothing in them to transcribe. Like in
+    `speech_chunks`, speech runs shorter than `min_speech_s` don't count.
+    """
+    def __init__(self, detector, min_share=0.1, silence_db=-50.0, min_speech_s=0.25):
+        self.detector = detector
+        self.min_share = min_share
+        self.silence_db = silence_db
+        self.min_speech = max(1, int(min_speech_s / FRAME_SECONDS))
+
+    def kept(self, flags):
+        """Number of frames in speech runs of at least `min_speech` frames."""
+        edges = np.diff(np.concatenate([[0], flags.astype(np.int8), [0]]))
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        return int(runs[runs >= self.min_speech].sum())
+
+    def __call__(self, frames):
+        flags = np.asarray(self.detector(frames), dtype=bool)
+        if len(flags) and self.kept(flags) < self.min_share * len(flags):
+            if 10 * np.log10(np.mean(frames ** 2) + 1e-10) > self.silence_db:
+                return np.ones(len(flags), dtype=bool)
+        return flags
+
+
+def make_detector(mode='auto', min_share=0.1):
+    """Speech detector for `mode` ('auto', 'webrtc', 'energy'), or None when VAD is 'off'.
+
+    'auto' is WebRTC's detector when webrtcvad is installed and no VAD
+    otherwise; the energy detector loses speech over background noise, so
+    it is only used when asked for. Blocks of which the detector keeps
+    less than `min_share` are transcribed unfiltered, see `MinimumSpeechGuard`.
+    """
+    if mode not in ('off', 'auto', 'webrtc', 'energy'):
+        raise ValueError(f"Unknown VAD mode: {mode}")
+    if mode == 'off' or (mode == 'auto' and webrtcvad is None):
+        return None
+    if mode == 'energy':
+        return MinimumSpeechGuard(EnergyDetector(), min_share)
+    if webrtcvad is None:
+        raise ImportError("VAD mode 'webrtc' needs the webrtcvad package")
+    return MinimumSpeechGuard(WebRTCDetector(), min_share)
+
+
+def offset_chunks(blocks):
+    """`(offset in seconds, audio)` for consecutive `blocks`, i.e. chunking without VAD."""
+    offset = 0
+    for block in blocks:
+        yield offset / SAMPLE_RATE, block
+        offset += len(block)
+
+
+def speech_chunks(blocks, detector, max_length_s=120.0, max_gap_s=2.0, min_speech_s=0.25, min_pause_s=0.3, pad_s=0.2):
+    """Cut decoded audio `blocks` into speech chunks of at most `max_length_s` seconds.
+
+    Yields `(offset in seconds, audio)` where the offset is the chunk's
+    start in the original audio, so times within a chunk map back to
+    absolute time by adding it. Speech separated by more than `max_gap_s`
+    seconds of non-speech goes to different chunks and the non-speech in
+    between is dropped. Chunks that would grow past `max_length_s` are cut
+    in the middle of their latest pause of at least `min_pause_s`, so
+    words aren't split. Bursts shorter than `min_speech_s` don't count as
+    speech, and `pad_s` of audio is kept around every chunk, as far as
+    the chunk stays within `max_length_s`.
+    """
+    max_frames = int(max_length_s / FRAME_SECONDS)
+    max_gap = int(max_gap_s / FRAME_SECONDS)
+    min_speech = max(1, int(min_speech_s / FRAME_SECONDS))
+    min_pause = int(min_pause_s / FRAME_SECONDS)
+    pad = int(pad_s / FRAME_SECONDS)
+
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0  # frame index of buffer[0]
+    frame = 0  # next frame to classify
+    chunk_start = None
+    speech_end = 0  # frame after the last speech frame
+    run_start = None  # first frame of the current speech run
+    pause_start = None  # first frame of the current pause inside a chunk
+    cut = None  # where to cut the chunk if it gets too long
+
+    def audio(lo, hi):
+        return buffer[(lo - buffer_start) * FRAME_SAMPLES:(hi - buffer_start) * FRAME_SAMPLES]
+
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        num_frames = len(buffer) // FRAME_SAMPLES + buffer_start - frame
+        if num_frames <= 0:
+            continue
+        lo = (frame - buffer_start) * FRAME_SAMPLES
+        flags = detector(buffer[lo:lo + num_frames * FRAME_SAMPLES].reshape(num_frames, FRAME_SAMPLES))
+
+        for is_speech in flags:
+            if is_speech:
+                run_start = frame if run_start is None else run_start
+                if pause_start is not None and frame - pause_start >= min_pause:
+                    cut = (pause_start + frame) // 2
+                pause_start = None
+                if frame - run_start + 1 >= min_speech:
+                    if chunk_start is None:
+                        chunk_start = max(buffer_start, run_start - pad)
+                        cut = None
+                    elif frame + 1 - chunk_start > max_frames:
+                        end = cut if cut is not None and cut > chunk_start else frame
+                        yield chunk_start * FRAME_SECONDS, audio(chunk_start, end)
+                        chunk_start, cut = end, None
+                    speech_end = frame + 1
+            else:
+                run_start = None
+                if chunk_start is not None:
+                    pause_start = frame if pause_start is None else pause_start
+                    if frame - speech_end >= max_gap:
+                        yield chunk_start * FRAME_SECONDS, audio(chunk_start, min(speech_end + pad, chunk_start + max_frames))
+                        chunk_start, pause_start, cut = None, None, None
+            frame += 1
+
+        # Only audio that may still end up in a chunk is kept
+        keep_from = chunk_start if chunk_start is not None else max(buffer_start, frame - min_speech - pad)
+        buffer = buffer[(keep_from - buffer_start) * FRAME_SAMPLES:]
+        buffer_start = keep_from
+
+    if chunk_start is not None:
+        yield chunk_start * FRAME_SECONDS, audio(chunk_start, min(speech_end + pad, chunk_start + max_frames))
@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import requests
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pytubefix import YouTube
+
+VIDEO_ID_PATTERN = re.compile(r"(?:v=|youtu\.be/|shorts/|embed/)([A-Za-z0-9_-]{11})")
+PLAYER_RESPONSE_PATTERN = re.compile(r"ytInitialPlayerResponse\s*=\s*(\{.+?\})\s*;\s*(?:var\s|</script>)", re.S)
+
+
+def extract_video_id(url):
+    """YouTube video id of a watch/short/embed url, or the input itself if it already is an id."""
+    match = VIDEO_ID_PATTERN.search(url)
+    if match:
+        return match.group(1)
+    if re.fullmatch(r"[A-Za-z0-9_-]{11}", url):
+        return url
+    return None
+
+
+class VideoMetadataCache:
+    """Persistent video id -> metadata cache whose entries expire after `ttl` seconds."""
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS videos (video_id TEXT PRIMARY KEY, metadata TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, video_id):
+        with self.lock:
+            row = self.conn.execute("SELECT metadata, fetched_at FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, video_id, metadata):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO videos (video_id, metadata, fetched_at) VALUES (?, ?, ?)",
+                (video_id, json.dumps(metadata), time.time()),
+            )
+            self.conn.commit()
+
+
+class VideoMetadataResolver:
+    """Resolves YouTube urls to metadata (title, length, publish time, streams).
+
+    Watch pages are fetched concurrently over one pooled HTTP session and
+    parsed directly; pytubefix is only used when a page can't be parsed.
+    Results are kept in a `VideoMetadataCache`.
+    """
+    def __init__(self, cache, max_workers=8):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-US,en;q=0.9'})
+
+    def resolve(self, url):
+        video_id = extract_video_id(url)
+        if video_id is None:
+            raise ValueError(f"Not a YouTube video url: {url}")
+        metadata = self.cache.get(video_id)
+        if metadata is not None:
+            return metadata
+        try:
+            metadata = self._fetch(video_id)
+        except Exception as e:
+            print(f"Falling back to pytubefix for {video_id}: {e}")
+            metadata = self._fetch_pytube(video_id)
+        self.cache.set(video_id, metadata)
+        return metadata
+
+    def resolve_many(self, urls):
+        """Resolve `urls` concurrently, results are in input order with None for failures."""
+        def resolve(url):
+            try:
+                return self.resolve(url)
+            except Exception as e:
+                print(f"Error resolving video metadata for {url}: {e}")
+                return None
+
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(urls)))) as executor:
+            return list(executor.map(resolve, urls))
+
+    def _fetch(self, video_id):
+        response = self.session.get('https://www.youtube.com/watch', params={'v': video_id}, timeout=10)
+        response.raise_for_status()
+        match = PLAYER_RESPONSE_PATTERN.search(response.text)
+        if not match:
+            raise ValueError("player response not found")
+        player_response = json.loads(match.group(1))
+        details = player_response['videoDetails']
+        microformat = player_response.get('microformat', {}).get('playerMicroformatRenderer', {})
+        streaming_data = player_response.get('streamingData', {})
+        streams = [{
+            'itag': fmt.get('itag'),
+            'mime_type': fmt.get('mimeType'),
+            'bitrate': fmt.get('bitrate'),
+            'filesize': int(fmt['contentLength']) if 'contentLength' in fmt else None,
+            'quality': fmt.get('qualityLabel') or fmt.get('audioQuality'),
+        } for fmt in streaming_data.get('formats', []) + streaming_data.get('adaptiveFormats', [])]
+        return {
+            'id': details['videoId'],
+            'title': details.get('title', ''),
+            'length': int(details.get('lengthSeconds', 0)),
+            'publish_time': microformat.get('publishDate'),
+            'url': f"https://www.youtube.com/watch?v={details['videoId']}",
+            'streams': streams,
+        }
+
+    def _fetch_pytube(self, video_id):
+        yt = YouTube(f"https://www.youtube.com/watch?v={video_id}")
+        return {
+            'id': yt.video_id,
+            'title': yt.title,
+            'length': yt.length,
+            'publish_time': yt.publish_date.isoformat() if yt.publish_date else None,
+            'url': yt.watch_url,
+            'streams': [{
+                'itag': stream.itag,
+                'mime_type': stream.mime_type,
+                'bitrate': stream.bitrate,
+                'filesize': None,  # reading Stream.filesize costs an extra request per stream
+                'quality': stream.resolution or stream.abr,
+            } for stream in yt.streams],
+        }
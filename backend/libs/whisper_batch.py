@@ -0,0 +1,171 @@
+import torch
+
+# Options whose effect the batched path reproduces; anything else goes through model.transcribe
+BATCH_OPTIONS = {'word_timestamps', 'language', 'task', 'fp16', 'verbose'}
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+class _EncodedModel:
+    """A Whisper model whose forward pass takes precomputed audio features instead of a mel.
+
+    Word-level alignment runs the model forward once more per segment;
+    handing it the features from the batched encoder pass saves encoding
+    every clip a second time.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, audio_features, tokens):
+        return self.model.decoder(tokens, audio_features)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def _segments(tokens, tokenizer, result, num_frames, time_precision):
+    """Split decoded tokens into timestamped segments the same way `whisper.transcribe` does."""
+    from whisper.audio import HOP_LENGTH, SAMPLE_RATE
+
+    def segment(start, end, tokens):
+        tokens = tokens.tolist()
+        return {
+            'seek': 0,
+            'start': start,
+            'end': end,
+            'text': tokenizer.decode([token for token in tokens if token < tokenizer.eot]),
+            'tokens': tokens,
+            'temperature': result.temperature,
+            'avg_logprob': result.avg_logprob,
+            'compression_ratio': result.compression_ratio,
+            'no_speech_prob': result.no_speech_prob,
+        }
+
+    timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+    single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+    consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0] + 1
+    segments = []
+    if len(consecutive) > 0:
+        slices = consecutive.tolist()
+        if single_timestamp_ending:
+            slices.append(len(tokens))
+        last_slice = 0
+        for current_slice in slices:
+            sliced = tokens[last_slice:current_slice]
+            segments.append(segment(
+                (sliced[0].item() - tokenizer.timestamp_begin) * time_precision,
+                (sliced[-1].item() - tokenizer.timestamp_begin) * time_precision,
+                sliced,
+            ))
+            last_slice = current_slice
+    else:
+        duration = num_frames * HOP_LENGTH / SAMPLE_RATE
+        timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+        if len(timestamps) > 0 and timestamps[-1].item() != tokenizer.timestamp_begin:
+            duration = (timestamps[-1].item() - tokenizer.timestamp_begin) * time_precision
+        segments.append(segment(0.0, duration, tokens))
+    return segments
+
+
+def _continues(tokens, tokenizer, num_frames, input_stride, word_timestamps=False):
+    """Whether `whisper.transcribe` could decode another window of a clip after this one.
+
+    With word timestamps, a window that doesn't end on a single timestamp
+    makes `whisper.transcribe` seek back to the end of its last word and
+    decode from there; where that lands depends on the alignment, so any
+    such window counts as continued.
+    """
+    timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+    if timestamp_tokens[-2:].tolist() == [False, True]:
+        return False
+    if word_timestamps:
+        return True
+    consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0] + 1
+    if len(consecutive) == 0:
+        return False
+    last_timestamp_pos = tokens[consecutive[-1].item() - 1].item() - tokenizer.timestamp_begin
+    return last_timestamp_pos * input_stride < num_frames
+
+
+def transcribe_batch(model, audios, **options):
+    """Transcribe `audios` (16 kHz float32 arrays) like `model.transcribe`, batching the clips that fit one window.
+
+    Clips of at most 30 seconds are encoded in a single forward pass and
+    decoded together, one batch per language. Clips whose greedy decode
+    fails Whisper's quality checks, windows after which `model.transcribe`
+    would go on decoding, longer clips, and options this path doesn't
+    reproduce fall back to `model.transcribe`. Batched clips get segments
+    and word timestamps of the same shape, split the same way; the
+    numbers can still differ slightly, since batched decoding pads and
+    runs the kernels on other shapes.
+    """
+    from whisper.audio import HOP_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+    from whisper.decoding import DecodingOptions
+    from whisper.tokenizer import get_tokenizer
+    from whisper.timing import add_word_timestamps
+
+    results = [None] * len(audios)
+    if set(options) - BATCH_OPTIONS:
+        return [model.transcribe(audio, **options) for audio in audios]
+    batched = [i for i, audio in enumerate(audios) if len(audio) <= N_SAMPLES]
+    if len(batched) < 2:
+        return [model.transcribe(audio, **options) for audio in audios]
+
+    fp16 = options.get('fp16', True) and model.device.type != 'cpu'
+    task = options.get('task', 'transcribe')
+    mels, num_frames = [], []
+    for i in batched:
+        # Padded and cut exactly like the first window of model.transcribe
+        mel = log_mel_spectrogram(audios[i], model.dims.n_mels, padding=N_SAMPLES)
+        content_frames = mel.shape[-1] - N_FRAMES
+        mels.append(pad_or_trim(mel[:, :content_frames], N_FRAMES))
+        num_frames.append(content_frames)
+    mels = torch.stack(mels).to(model.device).to(torch.float16 if fp16 else torch.float32)
+
+    with torch.no_grad():
+        features = model.embed_audio(mels)
+        if options.get('language') is not None or not model.is_multilingual:
+            languages = [options.get('language') or 'en'] * len(batched)
+        else:
+            _, probs = model.detect_language(features)
+            languages = [max(prob, key=prob.get) for prob in probs]
+
+    input_stride = N_FRAMES // model.dims.n_audio_ctx
+    time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE
+    encoded_model = _EncodedModel(model)
+    for language in sorted(set(languages)):
+        group = [j for j, lang in enumerate(languages) if lang == language]
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, language=language, task=task)
+        decoded = model.decode(features[group], DecodingOptions(task=task, language=language, temperature=0.0, fp16=fp16))
+        for j, result in zip(group, decoded):
+            i = batched[j]
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                results[i] = {'text': '', 'segments': [], 'language': language}
+                continue
+            tokens = torch.tensor(result.tokens, dtype=torch.long)
+            if (
+                result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                or result.avg_logprob < LOGPROB_THRESHOLD
+                or _continues(tokens, tokenizer, num_frames[j], input_stride, options.get('word_timestamps', False))
+            ):
+                # model.transcribe retries such windows at higher temperatures, or
+                # decodes the rest of the clip in a second window
+                results[i] = model.transcribe(audios[i], **options)
+                continue
+            segments = _segments(tokens, tokenizer, result, num_frames[j], time_precision)
+            if options.get('word_timestamps', False):
+                add_word_timestamps(
+                    segments=segments, model=encoded_model, tokenizer=tokenizer,
+                    mel=features[j], num_frames=num_frames[j], last_speech_timestamp=0.0,
+                )
+            for k, segment in enumerate(segments):
+                segment['id'] = k
+                if segment['start'] == segment['end'] or segment['text'].strip() == '':
+                    segment.update({'text': '', 'tokens': [], 'words': []})
+            results[i] = {'text': ''.join(segment['text'] for segment in segments), 'segments': segments, 'language': language}
+
+    for i, audio in enumerate(audios):
+        if results[i] is None:
+            results[i] = model.transcribe(audio, **options)
+    return results
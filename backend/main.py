@@ -1,10 +1,10 @@
 import os
-import shutil
 import requests
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from libs.overview import OverviewTask
 from backend.libs.search_yt import SearcYoutubeTask
+from libs.artifact_store import ArtifactStore
 
 
 load_dotenv()
@@ -25,9 +25,10 @@ if __name__ == "__main__":
         search_result = searcher.search(search_query)
         
         if search_result['success']:
-            # clean the downloads folder
-            shutil.rmtree('./downloads') # TODO: uncomment this when releasing the code
-            os.makedirs('./downloads', exist_ok=True)
+            # keep the downloads folder within its size budget instead of wiping it
+            artifact_store = ArtifactStore('./downloads', max_bytes=int(float(os.getenv('ARTIFACT_STORE_MAX_GB', 20)) * 1024 ** 3))
             for item in search_result['data']:
-                searcher.download_video(item, verbose=True)
+                with artifact_store.lease(item['video_id']):
+                    searcher.download_video(item, out_dir=artifact_store.video_dir(item['video_id']), verbose=True)
+            artifact_store.collect()
                 